@@ -0,0 +1,387 @@
+#!/usr/bin/env python3
+"""Benchmarks for the hot paths of the game engine and interfaces.
+
+Each benchmark is run on every combination of grid backend, grid size and
+level given on the command line, on a game seeded with a fixed seed, so
+that every run of the suite times the same work. The results are printed
+and saved as JSON, and the results of two runs (for example, from before
+and after a change) can be compared with --compare:
+
+    python benchmarks/bench.py -o before.json
+    ...
+    python benchmarks/bench.py -o after.json
+    python benchmarks/bench.py --compare before.json after.json
+
+A full run over the default sizes and levels takes a long time (mostly in
+the list backend's safe teleport on the largest grid); --size, --level-step
+and --bench can be used to run a smaller part of the suite.
+
+Recorded games (see flying_robots.replay) can be timed too, with --replay.
+
+The interface benchmarks are skipped if the interface can't be started
+(curses needs a terminal, and Tk needs a display)."""
+
+import json
+import platform
+import random
+import statistics
+import sys
+from argparse import ArgumentParser
+from configparser import ConfigParser
+from os.path import basename
+from time import perf_counter, strftime
+
+from flying_robots.actions import TELEPORT, move_action
+from flying_robots.config import calc_enemies, DEFAULT_CTRLSET
+from flying_robots.exceptions import GameOver, LevelComplete, GridFullError
+from flying_robots.game import Game
+from flying_robots.grid import grid_backends, neighbours
+from flying_robots.metadata import version
+from flying_robots.replay import Replay
+
+SEED = 20180101
+DEFAULT_SIZES = ['59x22x36', '118x44x72', '236x88x144']
+# The number of calls timed together by the benchmarks of cheap functions.
+CALLS = 1000
+
+
+def make_config(size, backend, max_level):
+    x, y, z = size
+    conf = ConfigParser()
+    conf['player'] = {'name': 'bench'}
+    conf['game'] = {'start_level': '1', 'hiscore': 'no',
+            'max_level': str(max_level), 'auto_teleport': 'no',
+            'seed': str(SEED), 'ctrlset': DEFAULT_CTRLSET}
+    conf['grid'] = {'x': x, 'y': y, 'z': z, 'backend': backend}
+    return conf
+
+def setup_level(game, level):
+    """Starts the given level afresh, always with the same layout."""
+    game.rng.seed(SEED + level)
+    game.score = 0
+    game.play_level(level)
+
+
+# Each benchmark takes a Game which is already on the level to be timed,
+# and returns a function which sets up one run and returns another function
+# which does the work to be timed (and returns the number of calls it
+# made, for benchmarks which time many calls at once).
+
+def bench_populate(game, level):
+    def setup():
+        game.rng.seed(SEED + level)
+        return lambda: game.grid.populate(calc_enemies(level))
+    return setup
+
+def bench_move_enemies(game, level):
+    def setup():
+        setup_level(game, level)
+        def run():
+            try:
+                game.grid.move_enemies()
+            except (GameOver, LevelComplete):
+                pass
+        return run
+    return setup
+
+def bench_tile_is_safe(game, level):
+    grid = game.grid
+    rng = random.Random(SEED)
+    tiles = [[rng.randrange(grid.x), rng.randrange(grid.y),
+            rng.randrange(grid.z)] for _ in range(CALLS)]
+    def setup():
+        def run():
+            tile_is_safe = grid.tile_is_safe
+            for coords in tiles:
+                tile_is_safe(coords)
+            return len(tiles)
+        return run
+    return setup
+
+def bench_place_char(game, level):
+    # Moves the player from one empty tile to another, as the player does
+    # when moving around the grid.
+    grid = game.grid
+    def setup():
+        setup_level(game, level)
+        player = grid.player
+        tiles = [grid.get_random_empty_coords() for _ in range(CALLS)]
+        tiles.append(player.coords)
+        def run():
+            place_char = grid.place_char
+            for coords in tiles:
+                grid.clear_tile(player.coords)
+                player.coords = coords
+                place_char(player)
+            return len(tiles)
+        return run
+    return setup
+
+def bench_teleport(game, level):
+    grid = game.grid
+    def setup():
+        setup_level(game, level)
+        def run():
+            grid.player.teleport(safe=True)
+            grid.place_char(grid.player)
+        return run
+    return setup
+
+def bench_wait(game, level):
+    def setup():
+        setup_level(game, level)
+        return lambda: game.grid.fast_forward() and None
+    return setup
+
+def bench_afap(game, level):
+    # Plays the level out by moving as far as possible in a random safe
+    # direction each turn, teleporting when there is none.
+    afap_moves = {d: move_action(*d, afap=True) for d in neighbours}
+    def setup():
+        setup_level(game, level)
+        rng = random.Random(SEED)
+        def run():
+            while True:
+                moves = game.grid.safe_moves(game.player_coords)
+                if moves:
+                    action = afap_moves[rng.choice(moves)]
+                else:
+                    action = TELEPORT
+                result = game.step(action)
+                if result.over or not (result.moved or result.turns):
+                    break
+        return run
+    return setup
+
+def bench_curses_update_grid(game, level):
+    import curses
+    from flying_robots.ui.curses_ui import GameInterface
+    if not sys.stdout.isatty():
+        raise Unavailable('stdout is not a terminal')
+    if game not in _interfaces:
+        # The interface's constructor runs its main loop, so set up only the
+        # parts of it that update_grid uses.
+        ui = GameInterface.__new__(GameInterface)
+        ui.game = game
+        ui.drawn_elev = None
+        x, y, _ = game.grid_size
+        curses.initscr()
+        try:
+            ui.grid_win = curses.newwin(y+2, x+2)
+        finally:
+            curses.endwin()
+        _interfaces[game] = ui
+    return _bench_update_grid(game, level, _interfaces[game])
+
+def bench_tkinter_update_grid(game, level):
+    import tkinter
+    from flying_robots.ui.tkinter_ui import GameInterface
+    from flying_robots.ui.controls import get_classic_ctrls
+    if game not in _tk_interfaces:
+        try:
+            root = tkinter.Tk()
+        except tkinter.TclError as e:
+            raise Unavailable(str(e))
+        root.withdraw()
+        conf = make_config(game.grid_size, 'list', game.max_level)
+        ui = GameInterface(conf, get_classic_ctrls(), root)
+        ui.game = game
+        _tk_interfaces[game] = ui
+    return _bench_update_grid(game, level, _tk_interfaces[game])
+
+# The interfaces used by the benchmarks above, kept so that each game only
+# needs one of each.
+_interfaces = {}
+_tk_interfaces = {}
+
+def _bench_update_grid(game, level, ui):
+    def setup():
+        setup_level(game, level)
+        def run():
+            for elev in range(game.grid.z):
+                game.elev = elev
+                ui.update_grid()
+            return game.grid.z
+        return run
+    return setup
+
+class Unavailable(Exception):
+    """Raised by a benchmark which can't be run in this environment."""
+
+
+benchmarks = {
+        'populate':             bench_populate,
+        'move_enemies':         bench_move_enemies,
+        'tile_is_safe':         bench_tile_is_safe,
+        'place_char':           bench_place_char,
+        'teleport':             bench_teleport,
+        'wait':                 bench_wait,
+        'afap':                 bench_afap,
+        'curses_update_grid':   bench_curses_update_grid,
+        'tkinter_update_grid':  bench_tkinter_update_grid
+        }
+
+
+def time_benchmark(setup, repeat, min_time):
+    """Times the function returned by setup at least repeat times, and until
+    at least min_time seconds have been spent in it. Returns a dict of the
+    timings, per call."""
+    times = []
+    total = 0
+    while len(times) < repeat or total < min_time:
+        run = setup()
+        start = perf_counter()
+        calls = run() or 1
+        elapsed = perf_counter() - start
+        total += elapsed
+        times.append(elapsed / calls)
+    return {
+            'runs':     len(times),
+            'calls':    calls,
+            'min':      min(times),
+            'median':   statistics.median(times),
+            'mean':     statistics.mean(times)
+            }
+
+def run_suite(backends, sizes, levels, names, repeat, min_time):
+    results = []
+    unavailable = {}
+    for backend in backends:
+        for size in sizes:
+            conf = make_config(size, backend, max(levels))
+            try:
+                game = Game(conf, SEED)
+            except ImportError as e:
+                print('Skipping the {} backend: {}'.format(backend, e))
+                break
+            for level in levels:
+                try:
+                    setup_level(game, level)
+                except (GridFullError, GameOver):
+                    print('{} {}: level {} does not fit on the grid'.format(
+                            backend, format_size(size), level))
+                    break
+                for name in names:
+                    if name in unavailable:
+                        continue
+                    try:
+                        setup = benchmarks[name](game, level)
+                    except (Unavailable, ImportError) as e:
+                        unavailable[name] = str(e)
+                        print('Skipping {}: {}'.format(name, e))
+                        continue
+                    timing = time_benchmark(setup, repeat, min_time)
+                    timing.update({
+                        'benchmark':    name,
+                        'backend':      backend,
+                        'size':         format_size(size),
+                        'level':        level,
+                        'enemies':      calc_enemies(level)
+                        })
+                    results.append(timing)
+                    print_result(timing)
+    return results, unavailable
+
+def run_replays(paths, repeat, min_time):
+    """Times playing back each of the given replay files."""
+    results = []
+    for path in paths:
+        replay = Replay.load(path)
+        grid = replay.config['grid']
+        def setup():
+            return lambda: replay.play() and None
+        timing = time_benchmark(setup, repeat, min_time)
+        timing.update({
+            'benchmark':    'replay:' + basename(path),
+            'backend':      grid.get('backend', 'list'),
+            'size':         format_size(grid[a] for a in 'xyz'),
+            'level':        replay.config['game'].getint('start_level'),
+            'actions':      len(replay)
+            })
+        results.append(timing)
+        print_result(timing)
+    return results
+
+def format_size(size):
+    return 'x'.join(str(n) for n in size)
+
+def parse_size(s):
+    return tuple(int(n) for n in s.split('x'))
+
+def result_key(r):
+    return (r['benchmark'], r['backend'], r['size'], r['level'])
+
+def print_result(r):
+    print('{benchmark:20} {backend:6} {size:12} level {level:2}: '
+            '{median:.3e}s (min {min:.3e}s, {runs} runs)'.format(**r))
+
+def compare(old_file, new_file):
+    """Prints the ratio of the median time of each benchmark in new_file to
+    its median time in old_file."""
+    with open(old_file) as f:
+        old = {result_key(r): r for r in json.load(f)['results']}
+    with open(new_file) as f:
+        new = json.load(f)['results']
+    for r in new:
+        key = result_key(r)
+        if key not in old:
+            continue
+        ratio = r['median'] / old[key]['median']
+        print('{:20} {:6} {:12} level {:2}: {:.2f}x'.format(*key, ratio))
+
+def main():
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-o', '--output', metavar='FILE',
+            help='save the results to FILE as JSON')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'),
+            help='compare the results saved in two JSON files and exit')
+    parser.add_argument('--backend', dest='backends', action='append',
+            choices=grid_backends, help='the grid backend to benchmark '
+            '(may be given more than once; default: all)')
+    parser.add_argument('--size', dest='sizes', action='append',
+            metavar='XxYxZ', help='a grid size to benchmark (may be given '
+            'more than once; default: {})'.format(', '.join(DEFAULT_SIZES)))
+    parser.add_argument('--max-level', type=int, default=25,
+            help='benchmark levels 1 to N (default: 25)', metavar='N')
+    parser.add_argument('--level-step', type=int, default=1, metavar='N',
+            help='only benchmark every Nth level (default: 1)')
+    parser.add_argument('--bench', dest='names', action='append',
+            choices=sorted(benchmarks), help='a benchmark to run (may be '
+            'given more than once; default: all)')
+    parser.add_argument('--replay', dest='replays', action='append',
+            metavar='FILE', help='time playing back the replay in FILE '
+            '(may be given more than once); if any replays are given, the '
+            'other benchmarks are only run if --bench is given')
+    parser.add_argument('--repeat', type=int, default=3, metavar='N',
+            help='time each benchmark at least N times (default: 3)')
+    parser.add_argument('--min-time', type=float, default=0.2,
+            metavar='SECS', help='time each benchmark for at least SECS '
+            'seconds (default: 0.2)')
+    options = parser.parse_args()
+
+    if options.compare:
+        compare(*options.compare)
+        return
+
+    backends = options.backends or list(grid_backends)
+    sizes = [parse_size(s) for s in (options.sizes or DEFAULT_SIZES)]
+    levels = list(range(1, options.max_level+1, options.level_step))
+    names = options.names or ([] if options.replays else list(benchmarks))
+    results, unavailable = run_suite(backends, sizes, levels, names,
+            options.repeat, options.min_time)
+    results.extend(run_replays(options.replays or [], options.repeat,
+            options.min_time))
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump({
+                'version':      version,
+                'python':       platform.python_version(),
+                'platform':     platform.platform(),
+                'date':         strftime('%Y-%m-%dT%H:%M:%S'),
+                'seed':         SEED,
+                'skipped':      unavailable,
+                'results':      results
+                }, f, indent=1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,29 @@
+"""The actions that the player can take on a turn. Each action is encoded as
+a small integer (which fits in a single byte), so that it can be passed to
+Game.step or stored compactly."""
+
+from flying_robots.grid import neighbours
+
+# A move by neighbours[i] is encoded as MOVE + i, and a move as far as
+# possible in the same direction as MOVE_AFAP + i.
+MOVE = 0
+MOVE_AFAP = MOVE + len(neighbours)
+TELEPORT = MOVE_AFAP + len(neighbours)
+SAFE_TELEPORT = TELEPORT + 1
+WAIT = SAFE_TELEPORT + 1
+
+_move_codes = {d: i for i, d in enumerate(neighbours)}
+
+def move_action(dx, dy, dz, afap=False):
+    """Returns the action for moving by dx, dy, dz."""
+    base = MOVE_AFAP if afap else MOVE
+    return base + _move_codes[(dx, dy, dz)]
+
+def is_move(action):
+    return MOVE <= action < TELEPORT
+
+def decode_move(action):
+    """The inverse of move_action. Returns (dx, dy, dz, afap)."""
+    afap = action >= MOVE_AFAP
+    dx, dy, dz = neighbours[action - (MOVE_AFAP if afap else MOVE)]
+    return dx, dy, dz, afap
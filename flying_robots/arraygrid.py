@@ -0,0 +1,517 @@
+"""A game grid which stores the occupancy of each tile as a small integer
+code in a numpy array, rather than as a nested list of object references.
+This module requires numpy."""
+
+from itertools import repeat
+
+import numpy
+
+from flying_robots import stats
+from flying_robots.chars import (Robot, EntityStore, PlayerView, view_classes,
+        gamecode, EMPTY, ROBOT, JUNK, PLAYER)
+from flying_robots.exceptions import BadTileError
+from flying_robots.grid import (GameGrid, neighbours, PLAYING,
+        LEVEL_COMPLETE, PLAYER_DEAD, MOVED, DESTROYED, JUNKED, FREE_BLOCK)
+
+# Each tile's value in the danger map is the number of robots on or next to
+# it, plus BLOCKED if the player cannot move there because it is junk or out
+# of bounds. A tile is safe if its low bits (DANGER_MASK) are zero, and is a
+# safe, empty destination for the player if its value is zero.
+BLOCKED = 32
+DANGER_MASK = BLOCKED - 1
+
+# The code of the padding after the last tile in the grid's array (see
+# ArrayGrid.reset_free), which is never counted as free.
+OFF_GRID = -1
+
+def _neighbour_sum(a, axis):
+    """Returns an array in which each element is the sum of the
+    corresponding element of a and its neighbours on either side along the
+    given axis."""
+    lo = [slice(None)] * 3
+    hi = [slice(None)] * 3
+    lo[axis] = slice(None, -1)
+    hi[axis] = slice(1, None)
+    lo, hi = tuple(lo), tuple(hi)
+    total = a.copy()
+    total[hi] += a[lo]
+    total[lo] += a[hi]
+    return total
+
+def _contains(tiles, index):
+    """Returns a mask of the elements of index which are in tiles, a sorted
+    array of linear indices. This is cheaper than numpy.isin when tiles is
+    small."""
+    if not len(tiles):
+        return numpy.zeros(numpy.shape(index), dtype=bool)
+    pos = numpy.searchsorted(tiles, index).clip(max=len(tiles)-1)
+    return tiles[pos] == index
+
+def _crowding(index):
+    """Takes an array of the linear indices of the tiles that robots are
+    moving to. Returns the indices (into that array) of the robots which
+    share a tile with another, and of the first robot on each shared tile."""
+    # Collisions are rare, so it is cheaper to find the shared tiles with
+    # a plain sort, and only then look at the robots involved.
+    ordered = numpy.sort(index)
+    shared = ordered[1:][ordered[1:] == ordered[:-1]]
+    if not len(shared):
+        return shared, shared
+    crowded = numpy.flatnonzero(_contains(shared, index))
+    _, first = numpy.unique(index[crowded], return_index=True)
+    return crowded, crowded[first]
+
+class ArrayGrid(GameGrid):
+
+    """A game grid backed by a numpy array.
+
+    self.grid is a (z, y, x) array holding the class code (see
+    flying_robots.chars) of whatever occupies each tile. The occupants
+    themselves are kept separately, in self.store, an EntityStore. self.ids
+    maps the linear index of each occupied tile to the slot of its occupant
+    in the store. Keeping all the robots' coords in one array means that
+    they can be moved in a single batch operation each turn.
+
+    The Player, Robot and Junk objects returned by get_tile, view_plan etc
+    are views of the store (see flying_robots.chars).
+
+    self.danger is a danger map (see BLOCKED, above) with a border one tile
+    wide around the grid, so that robots on the edge need no special
+    treatment. It is updated for every robot that moves, dies or becomes
+    junk, which makes tile_is_safe and has_safe_move simple lookups.
+
+    The interface is the same as that of GameGrid, so the game can use either
+    interchangeably."""
+
+    def get_empty_grid(self, x, y, z):
+        self.store = EntityStore()
+        self.player = PlayerView(0, self)
+        self.ids = numpy.zeros(x * y * z, dtype=numpy.int32)
+        self.danger = numpy.zeros((z+2, y+2, x+2), dtype=numpy.int8)
+        self.danger_flat = self.danger.reshape(-1)
+        # Offsets of each tile's neighbours in self.danger_flat.
+        self.danger_offsets = numpy.array(
+                [(dz*(y+2) + dy)*(x+2) + dx for dx, dy, dz in neighbours])
+        volume = x * y * z
+        blocks = numpy.full((-(-volume // FREE_BLOCK), FREE_BLOCK), OFF_GRID,
+                dtype=numpy.int8)
+        # A flat view of the same buffer, indexed by linear tile index.
+        self.flat = blocks.reshape(-1)[:volume]
+        self.flat.fill(EMPTY)
+        self.free_blocks = blocks
+        self.reset_free()
+        return self.flat.reshape((z, y, x))
+
+    def clear_grid(self):
+        self.grid.fill(EMPTY)
+
+    def populate(self, enemies):
+        tiles = numpy.array(self.sample_tiles(enemies + 1))
+        # As in GameGrid, the last tile drawn goes to the player, who must be
+        # in slot 0.
+        tiles = numpy.roll(tiles, 1)
+        codes = numpy.full(len(tiles), ROBOT, dtype=numpy.int8)
+        codes[0] = PLAYER
+        self.store.reset(numpy.column_stack(self.to_coords(tiles)), codes)
+        self.rebuild()
+
+    def rebuild(self):
+        """Rebuilds the grid, the tile-to-slot map, the free tile index and
+        the danger map from the entities in the store."""
+        store = self.store
+        live = numpy.flatnonzero(store.alive)
+        tiles = self.to_indices(store.coords[live])
+        codes = store.codes[live]
+        self.clear_grid()
+        self.flat[tiles] = codes
+        self.ids[tiles] = live
+        self.reset_free()
+        self.danger.fill(BLOCKED)
+        self.danger[1:-1, 1:-1, 1:-1] = 0
+        robots = tiles[codes == ROBOT]
+        self.update_danger(robots[:0], robots)
+        self.danger_flat[self.to_padded(tiles[codes == JUNK])] += BLOCKED
+        if self.events is not None:
+            self.publish_reset()
+
+    def dump_entities(self):
+        store = self.store
+        live = numpy.flatnonzero(store.alive[1:]) + 1
+        tiles = self.to_indices(store.coords[live])
+        order = numpy.argsort(tiles, kind='stable')
+        tiles = numpy.concatenate(([self.to_index(self.player.coords)],
+                tiles[order]))
+        codes = numpy.concatenate(([PLAYER], store.codes[live[order]]))
+        return (tiles.astype('<u4').tobytes(),
+                codes.astype(numpy.uint8).tobytes())
+
+    def load_entities(self, tiles, codes):
+        tiles = numpy.frombuffer(tiles, dtype='<u4').astype(numpy.intp)
+        codes = numpy.frombuffer(codes, dtype=numpy.uint8)
+        self.store.reset(numpy.column_stack(self.to_coords(tiles)), codes)
+        self.rebuild()
+
+    def view(self, slot):
+        """Returns a view of the entity in the given slot of the store."""
+        return view_classes[self.store.codes[slot]](slot, self)
+
+    @property
+    def enemies(self):
+        return {self.view(s) for s in self.store.slots(ROBOT).tolist()}
+
+    @property
+    def objects(self):
+        return {self.view(s) for s in
+                numpy.flatnonzero(self.store.alive).tolist()}
+
+    @property
+    def enemy_count(self):
+        return self.store.count(ROBOT)
+
+    def update_danger(self, removed, added):
+        """Updates the danger map for robots leaving the tiles at the linear
+        indices in removed and arriving on those in added."""
+        size = len(self.danger_flat)
+        removed = self.to_padded(removed)
+        added = self.to_padded(added)
+        if len(self.danger_offsets) * (len(removed) + len(added)) > size // 2:
+            # With many robots, it is cheaper to find the change in the
+            # number of robots on each tile, and then sum that over each
+            # tile's neighbours one axis at a time.
+            delta = numpy.bincount(added, minlength=size)
+            delta -= numpy.bincount(removed, minlength=size)
+            delta = delta.astype(numpy.int8).reshape(self.danger.shape)
+            for axis in range(3):
+                delta = _neighbour_sum(delta, axis)
+            self.danger += delta
+        else:
+            offsets = self.danger_offsets
+            for padded, n in ((removed, -1), (added, 1)):
+                tiles, counts = numpy.unique(
+                        (padded[:, None] + offsets).ravel(),
+                        return_counts=True
+                        )
+                self.danger_flat[tiles] += (counts * n).astype(numpy.int8)
+
+    # The free tile index works as in GameGrid, except that the grid's own
+    # array stands in for self.taken. Its buffer is laid out in blocks of
+    # FREE_BLOCK tiles (self.free_blocks, padded at the end with OFF_GRID),
+    # so that enemies_turn can recount the free tiles in the blocks it has
+    # changed in bulk. For the same reason, the counts are kept in a plain
+    # array (self.free_counts) rather than a Fenwick tree. nth_free sums all
+    # of them with numpy, which takes about as long as walking a tree in
+    # Python would.
+
+    def reset_free(self):
+        self.free_counts = numpy.count_nonzero(self.free_blocks == EMPTY,
+                axis=1)
+        self.n_free = int(self.free_counts.sum())
+
+    def add_free(self, index):
+        self.free_counts[index // FREE_BLOCK] += 1
+        self.n_free += 1
+
+    def take_free(self, index):
+        self.free_counts[index // FREE_BLOCK] -= 1
+        self.n_free -= 1
+
+    def update_free(self, tiles):
+        """Recounts the free tiles in the blocks holding the given tiles (an
+        array of linear indices), once the grid has been updated."""
+        blocks = numpy.unique(tiles // FREE_BLOCK)
+        self.free_counts[blocks] = numpy.count_nonzero(
+                self.free_blocks[blocks] == EMPTY, axis=1)
+        self.n_free = int(self.free_counts.sum())
+
+    def nth_free(self, n):
+        totals = numpy.cumsum(self.free_counts)
+        block = int(numpy.searchsorted(totals, n, side='right'))
+        if block:
+            n -= int(totals[block-1])
+        free = numpy.flatnonzero(self.free_blocks[block] == EMPTY)
+        return block * FREE_BLOCK + int(free[n])
+
+    def safe_tiles(self):
+        free = numpy.flatnonzero(self.flat == EMPTY)
+        return free[self.danger_flat[self.to_padded(free)] == 0].tolist()
+
+    def to_indices(self, coords):
+        """Like to_index, but takes an (N, 3) array of coords and returns an
+        array of linear indices. No bounds checking is done."""
+        coords = coords.astype(numpy.intp)
+        return (coords[:, 2] * self.y + coords[:, 1]) * self.x + coords[:, 0]
+
+    def to_padded(self, index):
+        """Converts a linear index (or an array of them) to the
+        corresponding index in self.danger_flat."""
+        yz, x = divmod(index, self.x)
+        z, y = divmod(yz, self.y)
+        return ((z+1) * (self.y+2) + y+1) * (self.x+2) + x+1
+
+    def set_tile(self, coords, new):
+        i = self.to_index(coords)
+        was_empty = (self.flat[i] == EMPTY)
+        if new is None:
+            self.flat[i] = EMPTY
+            if not was_empty:
+                self.add_free(i)
+        else:
+            self.flat[i] = gamecode(new)
+            self.ids[i] = new.slot
+            if was_empty:
+                self.take_free(i)
+
+    def get_tile(self, coords):
+        i = self.to_index(coords)
+        if self.flat[i] != EMPTY:
+            return self.view(self.ids[i])
+
+    def tile_is_empty(self, coords):
+        return self.flat[self.to_index(coords)] == EMPTY
+
+    def tile_is_safe(self, coords):
+        padded = self.to_padded(self.to_index(coords))
+        return not (self.danger_flat[padded] & DANGER_MASK)
+
+    def safe_moves(self, coords):
+        padded = self.to_padded(self.to_index(coords))
+        safe = (self.danger_flat[padded + self.danger_offsets] == 0)
+        return [neighbours[i] for i in numpy.flatnonzero(safe).tolist()]
+
+    def has_safe_move(self, coords):
+        padded = self.to_padded(self.to_index(coords))
+        return not self.danger_flat[padded + self.danger_offsets].all()
+
+    def enemies_turn(self):
+        # All robots move at once. Rather than placing each robot in turn,
+        # we count how many robots arrive on each tile: a robot survives only
+        # if it is alone on a tile without junk. This gives the same result
+        # as GameGrid.place_char, which kills two robots landing on the same
+        # tile, and any further robots landing on the resulting junk.
+        timed = stats.enabled
+        if timed:
+            decided = stats.clock()
+        store = self.store
+        slots = store.slots(ROBOT)
+        old = store.coords[slots]
+        new = old + numpy.sign(store.coords[0] - old)
+        old_lin = self.to_indices(old)
+        new_lin = self.to_indices(new)
+        if timed:
+            placed = stats.clock()
+        crowded, first = _crowding(new_lin)
+        self.flat[old_lin] = EMPTY
+        dies = (self.flat[new_lin] == JUNK)
+        dies[crowded] = True
+        if (new_lin == self.to_index(store.coords[0])).any():
+            store.alive[0] = False
+        # Collisions between robots leave junk, unless there is junk on the
+        # tile already. The first robot to arrive on the tile becomes the
+        # junk, and the rest are removed.
+        crash = first[self.flat[new_lin[first]] != JUNK]
+        crashes = new_lin[crash]
+        junk = slots[crash]
+        killed = dies.copy()
+        killed[crash] = False
+        store.coords[slots] = new
+        store.codes[junk] = JUNK
+        store.kill(slots[killed])
+        self.score_kills(Robot.__killscore__, int(numpy.count_nonzero(dies)))
+        survivors = slots[~dies]
+        self.flat[new_lin[~dies]] = ROBOT
+        self.ids[new_lin[~dies]] = survivors
+        self.flat[crashes] = JUNK
+        self.ids[crashes] = junk
+        if timed:
+            cleaned = stats.clock()
+        self.update_danger(old_lin, new_lin[~dies])
+        self.danger_flat[self.to_padded(crashes)] += BLOCKED
+        self.update_free(numpy.concatenate((old_lin, new_lin)))
+        if store.dead > len(store) // 2:
+            self.compact()
+        if timed:
+            stats.record_turn(decided, placed, cleaned, stats.clock(),
+                    len(slots))
+        if not store.alive[0]:
+            outcome = PLAYER_DEAD
+        elif not len(survivors):
+            outcome = LEVEL_COMPLETE
+        else:
+            outcome = PLAYING
+        if self.events is not None:
+            self.note_moves(old_lin, new_lin, new_lin[dies], crashes)
+            self.publish_outcome(outcome)
+        return outcome
+
+    def run_turns(self, step=None):
+        # As in enemies_turn, but only the player's and robots' coords are
+        # tracked from turn to turn. The rest of the grid is updated once,
+        # at the end.
+        store = self.store
+        player = store.coords[0].copy()
+        limit = None
+        if step is not None and any(step):
+            limit = self.run_length(player.tolist(), step)
+            if not limit:
+                return PLAYING, 0
+        if step is not None:
+            step = numpy.array(step, dtype=player.dtype)
+        if stats.enabled:
+            start = stats.clock()
+        start_lin = self.to_index(player.tolist())
+        slots = start_slots = store.slots(ROBOT)
+        robots = len(slots)
+        coords = store.coords[slots]
+        old_lin = self.to_indices(coords)
+        # The tiles and slots of any junk created along the way. junk_lin is
+        # kept sorted, for is_junk.
+        junk_lin = old_lin[:0]
+        junk_slots = slots[:0]
+        turns = 0
+        outcome = PLAYING
+        while outcome == PLAYING:
+            if step is not None:
+                # The player moves first, if the next tile is still empty
+                # and safe.
+                new = player + step
+                if turns == limit or self.is_junk(self.to_index(new.tolist()),
+                        junk_lin):
+                    break
+                # Any first step has already been checked by run_length.
+                checked = (turns == 0 and limit is not None)
+                if not checked and (
+                        numpy.abs(coords - new).max(axis=1) <= 1).any():
+                    break
+                player = new
+            player_lin = self.to_index(player.tolist())
+            turns += 1
+            coords += numpy.sign(player - coords)
+            lin = self.to_indices(coords)
+            crowded, first = _crowding(lin)
+            dies = self.is_junk(lin, junk_lin)
+            dies[crowded] = True
+            # The first robot to crash on each tile becomes the junk.
+            crash = first[~self.is_junk(lin[first], junk_lin)]
+            if len(crash):
+                junk_lin = numpy.append(junk_lin, lin[crash])
+                junk_slots = numpy.append(junk_slots, slots[crash])
+                order = numpy.argsort(junk_lin)
+                junk_lin = junk_lin[order]
+                junk_slots = junk_slots[order]
+            store.codes[slots[crash]] = JUNK
+            store.coords[slots[crash]] = coords[crash]
+            killed = dies.copy()
+            killed[crash] = False
+            store.kill(slots[killed])
+            self.score_kills(Robot.__killscore__,
+                    int(numpy.count_nonzero(dies)))
+            slots = slots[~dies]
+            coords = coords[~dies]
+            if (lin == player_lin).any():
+                store.alive[0] = False
+                outcome = PLAYER_DEAD
+            elif not len(slots):
+                outcome = LEVEL_COMPLETE
+        if stats.enabled:
+            stats.record_batch(start, turns, robots)
+        if not turns:
+            return outcome, turns
+        store.coords[0] = player
+        store.coords[slots] = coords
+        new_lin = self.to_indices(coords)
+        if self.events is not None:
+            # Robots which were destroyed are reported at the tiles they
+            # started from, as in GameGrid.note_batch.
+            moved = numpy.isin(start_slots, slots, assume_unique=True)
+            if start_lin != player_lin:
+                self.events.append((MOVED, start_lin, player_lin))
+            self.note_moves(old_lin[moved], new_lin, old_lin[~moved],
+                    junk_lin)
+        # Now bring the grid, the tile-to-slot map, the danger map and the
+        # free tile index up to date, as enemies_turn does every turn. The
+        # robots, the new junk and the player are all on different tiles.
+        old_tiles = numpy.append(old_lin, start_lin)
+        new_tiles = numpy.concatenate((new_lin, junk_lin))
+        self.flat[old_tiles] = EMPTY
+        if store.alive[0]:
+            self.flat[player_lin] = PLAYER
+            self.ids[player_lin] = 0
+            new_tiles = numpy.append(new_tiles, player_lin)
+        self.flat[new_lin] = ROBOT
+        self.ids[new_lin] = slots
+        self.flat[junk_lin] = JUNK
+        self.ids[junk_lin] = junk_slots
+        self.update_danger(old_lin, new_lin)
+        self.danger_flat[self.to_padded(junk_lin)] += BLOCKED
+        self.update_free(numpy.concatenate((old_tiles, new_tiles)))
+        if store.dead > len(store) // 2:
+            self.compact()
+        if self.events is not None:
+            self.publish_outcome(outcome)
+        return outcome, turns
+
+    def note_moves(self, old, new, destroyed, junk):
+        """Adds the events for robots moving from the tiles in old to the
+        corresponding tiles in new, robots being destroyed on the tiles in
+        destroyed and junk being left on the tiles in junk."""
+        moved = old != new
+        self.events.extend(zip(repeat(MOVED), old[moved].tolist(),
+                new[moved].tolist()))
+        self.events.extend(zip(repeat(DESTROYED), destroyed.tolist()))
+        self.events.extend(zip(repeat(JUNKED), junk.tolist()))
+
+    def is_junk(self, index, new_junk):
+        """Returns True for each linear index in index (which may be an
+        array) which has junk on it, either in the grid or in new_junk, a
+        sorted array of linear indices."""
+        return (self.flat[index] == JUNK) | _contains(new_junk, index)
+
+    def run_length(self, coords, step):
+        """Returns the number of steps the player could take from coords in
+        the direction step before reaching junk or the edge of the grid, as
+        things stand. Only the first step is checked for safety, as the
+        robots will have moved before any later step."""
+        dx, dy, dz = step
+        padded = self.to_padded(self.to_index(coords))
+        offset = (dz * (self.y+2) + dy) * (self.x+2) + dx
+        if self.danger_flat[padded + offset]:
+            return 0
+        n = 1
+        while not self.danger_flat[padded + (n+1) * offset] & BLOCKED:
+            n += 1
+        return n
+
+    def compact(self):
+        """Compacts the store and updates the tile-to-slot map to match."""
+        self.store.compact()
+        live = numpy.flatnonzero(self.store.alive)
+        self.ids[self.to_indices(self.store.coords[live])] = live
+
+    def occupants(self, elev=None):
+        """As GameGrid.occupants. The occupied tiles on the level are found
+        in the grid array, which is quick enough that no separate index is
+        kept."""
+        if elev is None:
+            elev = self.player.coords[2]
+        tiles = numpy.flatnonzero(self.grid[elev])
+        slots = self.ids[tiles + elev * self.y * self.x]
+        return {t: self.view(s) for t, s in zip(tiles.tolist(),
+                slots.tolist())}
+
+    def view_plan(self, elev=None):
+        """Returns the given z-level as a list of rows of objects (or None
+        for empty tiles), as GameGrid does. Only the occupied tiles on that
+        level need to be looked up."""
+        if elev is None:
+            elev = self.player.coords[2]
+        plan = [[None] * self.x for _ in range(self.y)]
+        offset = elev * self.y * self.x
+        ys, xs = self.grid[elev].nonzero()
+        for y, x in zip(ys.tolist(), xs.tolist()):
+            plan[y][x] = self.view(self.ids[offset + (y * self.x) + x])
+        return plan
+
+    def plane_codes(self, elev=None):
+        if elev is None:
+            elev = self.player.coords[2]
+        return self.grid[elev].tobytes()
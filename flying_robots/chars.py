@@ -2,6 +2,13 @@ class BadCharmapError(BaseException): pass
 
 from .exceptions import BadTileError
 
+try:
+    import numpy
+except ImportError:
+    # numpy is only needed for EntityStore, which is only used by the
+    # array-based grids.
+    numpy = None
+
 gameclasses = {
         'empty',
         'junk',
@@ -9,6 +16,19 @@ gameclasses = {
         'player'
         }
 
+# Small integer codes for each game class. These are used by grids that store
+# the occupancy of each tile in an array rather than as object references.
+EMPTY, ROBOT, JUNK, PLAYER = range(4)
+
+gameclass_codes = {
+        'empty':    EMPTY,
+        'robot':    ROBOT,
+        'junk':     JUNK,
+        'player':   PLAYER
+        }
+
+code_gameclasses = ('empty', 'robot', 'junk', 'player')
+
 def is_valid_charmap(charmap):
     # Currently, this just checks if all members of gameclasses are in charmap.
     # We should probably warn non-fatally if charmap has keys not in gameclasses.
@@ -21,55 +41,93 @@ def gameclass(obj):
     else:
         return obj.__gameclass__
 
+def gamecode(obj):
+    return gameclass_codes[gameclass(obj)]
+
 class BaseObject:
     
     """A base class representing anything that can occupy a tile on a
     grid."""
+
+    __slots__ = ('coords', 'grid', 'serial')
         
     def __init__(self, coords, grid):
         self.coords = coords
         self.grid = grid
+        self.serial = next(grid.serials)
+
+    def __hash__(self):
+        # Objects are hashed by a serial number rather than by id, so that
+        # sets of them are always iterated over in the same order, and a
+        # seeded game always plays out the same way.
+        return self.serial
 
 class Junk(BaseObject):
     
     """A class representing the junk left behind when 2 or more robots
     collide."""
     
+    __slots__ = ()
     __gameclass__ = 'junk'
 
 class BaseMoveableObject(BaseObject):
     
     """A base class representing anything that can move on a grid."""
 
+    __slots__ = ('is_alive',)
+
     def __init__(self, coords, grid):
         self.is_alive = True
         BaseObject.__init__(self, coords, grid)
 
     def _move_to(self, new_coords):
         self.grid.clear_tile(self.coords)
+        if self.grid.events is not None:
+            self.grid.note_move(self.coords, new_coords)
         self.coords = new_coords
 
+    def _check_move(self, new, stay, empty_only, safe_only):
+        """Returns the reason why this object cannot move to the tile at
+        new (which is its current tile if stay is True), or None if it
+        can."""
+        if not self.grid.is_valid_tile(new):
+            return 'Tile out of bounds.'
+        if empty_only and (not stay) and (not self.grid.tile_is_empty(new)):
+            return 'Player cannot move onto ccupied tile.'
+        if safe_only and (not self.grid.tile_is_safe(new)):
+            return 'Tile not safe.'
+
     def _move_by(self, dx, dy, dz, empty_only=False, safe_only=False):
         """Arguments are changes in x, y, z coords respectively.
         If optional fourth empty_only arg is True, raises BadTileError if
         tile being moved to is occupied. This is used when the player moves."""
-        stay = (dx == dy == dz == 0)
         old = self.coords
         new = [old[0] + dx, old[1] + dy, old[2] + dz]
-        # TODO: Get rid of BadTileError, and just return without doing anything
-        # instead.
-        # Possibly return a bool, okay_to_proceed, indicating whether the move
-        # was successful.
-        if not self.grid.is_valid_tile(new):
-            raise BadTileError('Tile out of bounds.')
-        if empty_only and (not stay) and (not self.grid.tile_is_empty(new)):
-            raise BadTileError('Player cannot move onto ccupied tile.')
-        if safe_only and (not self.grid.tile_is_safe(new)):
-            raise BadTileError('Tile not safe.')
+        stay = (dx == dy == dz == 0)
+        error = self._check_move(new, stay, empty_only, safe_only)
+        if error is not None:
+            raise BadTileError(error)
         self._move_to(new)
 
+    def _can_move_by(self, dx, dy, dz, empty_only=False, safe_only=False):
+        """Returns True if _move_by would succeed with these arguments."""
+        old = self.coords
+        new = [old[0] + dx, old[1] + dy, old[2] + dz]
+        stay = (dx == dy == dz == 0)
+        return self._check_move(new, stay, empty_only, safe_only) is None
+
+    def _try_move_by(self, dx, dy, dz, empty_only=False, safe_only=False):
+        """Like _move_by, but returns False rather than raising
+        BadTileError if the move is not allowed, and True otherwise."""
+        if not self._can_move_by(dx, dy, dz, empty_only, safe_only):
+            return False
+        old = self.coords
+        self._move_to([old[0] + dx, old[1] + dy, old[2] + dz])
+        return True
+
 class Robot(BaseMoveableObject):
     
+    __slots__ = ()
     __gameclass__ = 'robot'
     __killscore__ = 10
 
@@ -91,11 +149,128 @@ class Robot(BaseMoveableObject):
 
 class Player(BaseMoveableObject):
     
+    __slots__ = ()
     __gameclass__ = 'player'
     
     def move(self, dx, dy, dz, safe_only=False):
         self._move_by(dx, dy, dz, True, safe_only)
+
+    def can_move(self, dx, dy, dz, safe_only=False):
+        return self._can_move_by(dx, dy, dz, True, safe_only)
+
+    def try_move(self, dx, dy, dz, safe_only=False):
+        """Moves the player, returning False if the move is not allowed."""
+        return self._try_move_by(dx, dy, dz, True, safe_only)
     
-    def teleport(self):
-        new = self.grid.get_random_empty_coords()
+    def teleport(self, safe=False):
+        """Moves the player to a random empty tile. If safe is True, the tile
+        is chosen from those with no robot next to them, if there are any."""
+        new = None
+        if safe:
+            new = self.grid.get_random_safe_coords()
+        if new is None:
+            new = self.grid.get_random_empty_coords()
         self._move_to(new)
+
+
+class EntityStore:
+
+    """A compact store of all the entities (the player, robots and junk) on
+    a grid, held in parallel arrays rather than as separate objects. Used
+    by the array-based grids; requires numpy.
+
+    self.coords is an (N, 3) array of each entity's coords, self.codes holds
+    the class code of each entity and self.alive is a mask of the entities
+    which are still alive. An entity's index in these arrays is its slot.
+    The player is always in slot 0.
+
+    Dead entities keep their slots until compact() is called, so that the
+    slots of the other entities don't change every turn."""
+
+    def __init__(self):
+        self.reset(numpy.zeros((0, 3)), [])
+
+    def __len__(self):
+        return len(self.codes)
+
+    def reset(self, coords, codes):
+        self.coords = numpy.array(coords, dtype=numpy.int32).reshape(-1, 3)
+        self.codes = numpy.array(codes, dtype=numpy.int8)
+        self.alive = numpy.ones(len(self.codes), dtype=bool)
+        self.dead = 0
+
+    def slots(self, code):
+        """Returns the slots of all living entities with the given class
+        code."""
+        return numpy.flatnonzero(self.alive & (self.codes == code))
+
+    def count(self, code):
+        return int(numpy.count_nonzero(self.alive & (self.codes == code)))
+
+    def kill(self, slots):
+        self.alive[slots] = False
+        self.dead += len(slots)
+
+    def compact(self):
+        """Removes dead entities from the store, except the player, whose
+        slot never changes."""
+        keep = self.alive.copy()
+        keep[0] = True
+        self.coords = self.coords[keep]
+        self.codes = self.codes[keep]
+        self.alive = self.alive[keep]
+        self.dead = 0
+
+
+class _EntityView:
+
+    """A mixin which turns a game object into a lightweight view of a slot
+    in its grid's EntityStore, so that it holds no data of its own.
+
+    Views are cheap to create and are not meant to be kept, as a slot may
+    be reused for a different entity when the store is compacted (apart
+    from the player's)."""
+
+    __slots__ = ()
+
+    def __init__(self, slot, grid):
+        self.slot = slot
+        self.grid = grid
+
+    def __eq__(self, other):
+        return (isinstance(other, _EntityView) and (self.slot == other.slot)
+                and (self.grid is other.grid))
+
+    def __hash__(self):
+        return hash(self.slot)
+
+    @property
+    def coords(self):
+        return self.grid.store.coords[self.slot].tolist()
+
+    @coords.setter
+    def coords(self, coords):
+        self.grid.store.coords[self.slot] = coords
+
+    @property
+    def is_alive(self):
+        return bool(self.grid.store.alive[self.slot])
+
+    @is_alive.setter
+    def is_alive(self, alive):
+        self.grid.store.alive[self.slot] = alive
+
+class JunkView(_EntityView, Junk):
+    __slots__ = ('slot',)
+
+class RobotView(_EntityView, Robot):
+    __slots__ = ('slot',)
+
+class PlayerView(_EntityView, Player):
+    __slots__ = ('slot',)
+
+view_classes = {
+        ROBOT:  RobotView,
+        JUNK:   JunkView,
+        PLAYER: PlayerView
+        }
@@ -27,10 +27,14 @@ class _Section:
         else:
             return default
 
-    def getint(self, option):
+    def getint(self, option, fallback=None):
+        if not self.parent.has_option(self.name, option):
+            return fallback
         return self.parent.getint(self.name, option)
 
-    def getboolean(self, option):
+    def getboolean(self, option, fallback=None):
+        if not self.parent.has_option(self.name, option):
+            return fallback
         return self.parent.getboolean(self.name, option)
 
 
@@ -7,6 +7,7 @@ else:
     from flying_robots.compat import ConfigParser, ParsingError
 
 from flying_robots.metadata import app_name
+from flying_robots.grid import grid_backends, DEFAULT_BACKEND
 
 if os_name == 'nt':
     CONF_DIR = join(getenv('AppData'), app_name)
@@ -27,6 +28,7 @@ if not isdir(CONF_DIR):
 
 DEFAULT_UI = 'tkinter'
 DEFAULT_CTRLSET = 'old'
+DEFAULT_FPS = 30
 
 def get_conf_filepath(filename):
     """Takes a filename as an argument, returns the full path to that file,
@@ -51,8 +53,11 @@ def _get_default_conf(conf, write_to=None):
     x, y, z = 59, 22, 36    # 36-length z-axis gives a total area that is
                             # approximately (area of 2d grid) ** 1.5.
     conf['player'] = {'name': getenv('USER', 'j_doe')}
-    conf['game'] = {'start_level': '1', 'hiscore': 'yes', 'max_level': '25'}
-    conf['grid'] = {'x': x, 'y': y, 'z': z}
+    conf['game'] = {'start_level': '1', 'hiscore': 'yes', 'max_level': '25',
+            'auto_teleport': 'no'}
+    conf['grid'] = {'x': x, 'y': y, 'z': z, 'backend': DEFAULT_BACKEND}
+    conf['log'] = {'level': 'warning', 'file': 'robots.log'}
+    conf['ui'] = {'fps': DEFAULT_FPS}
 
     if write_to is not None:
         with open(write_to, 'w') as f:
@@ -70,16 +75,49 @@ def validate_conf(conf):
     grid = conf['grid']
     game = conf['game']
     try:
-        grid.getint('x')
-        grid.getint('y')
-        grid.getint('z')
-        game.getint('start_level')
+        x = grid.getint('x')
+        y = grid.getint('y')
+        z = grid.getint('z')
+        start_level = game.getint('start_level')
         game.getboolean('hiscore')
+        game.getint('seed', None)
     except ValueError as e:
         bad_val = e.args[0].split()[-1]
         print('Invalid configuration option: {}'.format(bad_val),
-                file=sys.stderr)
+                file=stderr)
         quit(1)
+    if calc_enemies(start_level) + 1 > x * y * z:
+        print('Level {} has too many robots to fit in a {}x{}x{} grid.'.format(
+                start_level, x, y, z), file=stderr)
+        quit(1)
+    backend = grid.get('backend', DEFAULT_BACKEND)
+    if backend not in grid_backends:
+        print('Invalid grid backend: {} (choose from {})'.format(
+                backend, ', '.join(grid_backends)), file=stderr)
+        quit(1)
+    if backend == 'array':
+        try:
+            import numpy
+        except ImportError:
+            print('The array grid backend requires numpy, which is not '
+                    'installed.', file=stderr)
+            quit(1)
+    if conf.has_section('log'):
+        from flying_robots.debug import log_levels
+        level = conf['log'].get('level', 'warning')
+        if level.lower() not in log_levels:
+            print('Invalid log level: {} (choose from {})'.format(
+                    level, ', '.join(log_levels)), file=stderr)
+            quit(1)
+    if conf.has_section('ui'):
+        try:
+            fps = conf['ui'].getint('fps', DEFAULT_FPS)
+        except ValueError:
+            fps = 0
+        if fps < 1:
+            print('Invalid frame rate: {} (must be a whole number of at least '
+                    '1)'.format(conf['ui']['fps']), file=stderr)
+            quit(1)
 
 def apply_opts_to_conf(conf, opts, optmap):
     for o in optmap:
@@ -87,6 +125,8 @@ def apply_opts_to_conf(conf, opts, optmap):
         val = getattr(opts, o)
         if val is None:
             continue
+        if not conf.has_section(sect):
+            conf.add_section(sect)
         conf[sect][name] = val
         if no_hiscore:
             conf['game']['hiscore'] = 'no'
@@ -1,5 +1,128 @@
-LOGFILE = '/tmp/robots.log'
+"""Logging, for debugging.
 
-def log(msg):
-    with open(LOGFILE, 'a') as f:
-        f.write(str(msg)+'\n')
+Messages are passed to a background thread through a queue, and the thread
+writes them to the log file in batches, so that logging a message never
+waits on file I/O. Messages below the current level are dropped before they
+are queued (or even formatted), so logging is cheap when it is turned down.
+
+The log file (LOGFILE in the config directory by default) and the level
+(WARNING by default) can be set in the "log" section of the config, and
+are applied by calling configure(conf)."""
+
+import atexit
+import threading
+from queue import SimpleQueue, Empty
+from time import strftime, localtime, time
+
+from flying_robots.config import get_conf_filepath
+
+DEBUG, INFO, WARNING, ERROR = 10, 20, 30, 40
+
+log_levels = {
+        'debug':    DEBUG,
+        'info':     INFO,
+        'warning':  WARNING,
+        'error':    ERROR
+        }
+level_names = {v: k.upper() for k, v in log_levels.items()}
+
+LOGFILE = 'robots.log'
+DEFAULT_LEVEL = 'warning'
+
+# The maximum number of messages written to the file at once.
+BATCH_SIZE = 256
+
+class Logger:
+
+    """Writes messages to a file from a background thread, which is started
+    when the first message is logged."""
+
+    def __init__(self, path, level=WARNING):
+        self.path = path
+        self.level = level
+        self.queue = SimpleQueue()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def log(self, msg, level=DEBUG):
+        if level < self.level:
+            return
+        if self.thread is None:
+            self.start()
+        self.queue.put((time(), level, msg))
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._write_loop,
+                        name='flying-robots-log', daemon=True)
+                self.thread.start()
+
+    def close(self):
+        """Writes any messages still in the queue and stops the writer
+        thread."""
+        with self.lock:
+            thread, self.thread = self.thread, None
+        if thread is not None:
+            self.queue.put(None)
+            thread.join()
+
+    def _write_loop(self):
+        # Each time a message arrives, any others already waiting are written
+        # along with it.
+        with open(self.path, 'a') as f:
+            while True:
+                batch = [self.queue.get()]
+                try:
+                    while len(batch) < BATCH_SIZE and batch[-1] is not None:
+                        batch.append(self.queue.get_nowait())
+                except Empty:
+                    pass
+                done = batch[-1] is None
+                if done:
+                    batch.pop()
+                f.write(''.join(self._format(*m) for m in batch))
+                f.flush()
+                if done:
+                    return
+
+    def _format(self, when, level, msg):
+        return '{} {} {}\n'.format(strftime('%Y-%m-%d %H:%M:%S',
+                localtime(when)), level_names[level], msg)
+
+_logger = Logger(get_conf_filepath(LOGFILE), log_levels[DEFAULT_LEVEL])
+atexit.register(_logger.close)
+
+def configure(conf):
+    """Sets the log file and level from the "log" section of the config, if
+    there is one."""
+    global _logger
+    if not conf.has_section('log'):
+        return
+    section = conf['log']
+    path = get_conf_filepath(section.get('file', LOGFILE))
+    level = log_levels[section.get('level', DEFAULT_LEVEL).lower()]
+    if path != _logger.path:
+        _logger.close()
+        _logger = Logger(path, level)
+        atexit.register(_logger.close)
+    else:
+        _logger.level = level
+
+def set_level(level):
+    _logger.level = level
+
+def log(msg, level=DEBUG):
+    _logger.log(msg, level)
+
+def debug(msg):
+    _logger.log(msg, DEBUG)
+
+def info(msg):
+    _logger.log(msg, INFO)
+
+def warning(msg):
+    _logger.log(msg, WARNING)
+
+def error(msg):
+    _logger.log(msg, ERROR)
@@ -10,6 +10,14 @@ class BadTileError(GameError):
     """Some moveable object has attempted to move onto a bad tile."""
     pass
 
+class GridFullError(GameError):
+    """There is not enough room in the grid for all of a level's robots."""
+    pass
+
+class BadSaveError(Exception):
+    """A saved game could not be loaded."""
+    pass
+
 class GameEvent(Exception):
     """A base exception class for certain events, such as the game ending or
     a level being completed, that may occur during the game."""
@@ -1,57 +1,226 @@
+import random
+import struct
+
+from flying_robots import stats
 from flying_robots.chars import gameclass
-from flying_robots.grid import GameGrid
-from flying_robots.exceptions import BadTileError, LevelComplete, GameOver
+from flying_robots.grid import (get_grid_class, DEFAULT_BACKEND,
+        LEVEL_COMPLETE, PLAYER_DEAD)
+from flying_robots.actions import (TELEPORT, SAFE_TELEPORT, WAIT,
+        move_action, is_move, decode_move)
+from flying_robots.exceptions import (BadTileError, GridFullError,
+        LevelComplete, GameOver, BadSaveError)
 from flying_robots.config import get_config, calc_enemies
 
+class TurnResult:
+
+    """The outcome of a call to Game.step.
+
+    moved is False if the player's action could not be carried out (for
+    example, a move onto an occupied or unsafe tile). turns is the number of
+    turns that passed, which may be more than one for AFAP moves, waits and
+    auto-teleports. kills is the number of enemies killed, and score is the
+    change in score (including any wait bonus)."""
+
+    __slots__ = ('moved', 'turns', 'kills', 'score', 'level_complete',
+            'player_dead')
+
+    def __init__(self):
+        self.moved = False
+        self.turns = 0
+        self.kills = 0
+        self.score = 0
+        self.level_complete = False
+        self.player_dead = False
+
+    @property
+    def over(self):
+        """True if the level has ended, whether or not the player won."""
+        return self.level_complete or self.player_dead
+
+# The layout of a snapshot of a game's state (see Game.snapshot): the level,
+# score, wait bonus, elevation being viewed, mode flags and number of
+# entities, then the state of the game's random number generator, then the
+# grid's entities (see GameGrid.dump_entities).
+_snapshot_state = struct.Struct('<IqqIBI')
+_snapshot_rng = struct.Struct('<B625I?d')
+WAITING, MOVE_AFAP, STICKY_VIEW = 1, 2, 4
+
+def snapshot_size(data):
+    """Returns the length of the snapshot at the start of data, going by
+    the number of entities in its header, or None if data is too short to
+    hold the header."""
+    if len(data) < _snapshot_state.size:
+        return None
+    n = _snapshot_state.unpack_from(data)[-1]
+    return _snapshot_state.size + _snapshot_rng.size + 5 * n
+
+# A saved game (see Game.save) is the magic bytes SAVE_MAGIC, a version
+# byte, the size of the grid, the length of the game's seed (as a decimal
+# string), the seed and then a snapshot. All integers are little-endian.
+SAVE_MAGIC = b'FRSV'
+SAVE_VERSION = 1
+_save_header = struct.Struct('<4sB3II')
+
 class Game:
 
-    def __init__(self, config):
+    def __init__(self, config, seed=None):
         self.start_level = config['game'].getint('start_level')
         self.max_level = config['game'].getint('max_level')
         x = config['grid'].getint('x')
         y = config['grid'].getint('y')
         z = config['grid'].getint('z')
+        backend = config['grid'].get('backend', DEFAULT_BACKEND)
+        self.auto_teleport = config['game'].getboolean('auto_teleport', False)
         self.name = config['player']['name']
+        self.config = config
+        # If record_dir is set, each game is recorded to a replay file there
+        # (see flying_robots.replay).
+        self.record_dir = config['game'].get('record_dir', None)
+        self.recorder = None
         self.grid_size = [x, y, z]
-        self.grid = GameGrid(x, y, z, self)
-        self.start_game()
+        # Each game has its own seed, drawn from self.seeds (which is seeded
+        # from the config, if a seed is given there), and all of its random
+        # choices are made by self.rng.
+        self.seeds = random.Random(config['game'].getint('seed', None))
+        self.rng = random.Random()
+        self.grid = get_grid_class(backend)(x, y, z, self, self.rng)
+        # Callbacks subscribed to the grid's change sets, which are kept so
+        # that they can be subscribed to any new grid.
+        self.subscribers = []
+        self.start_game(seed)
     
     # The following are functions called by the UI to change game state
 
-    def start_game(self):
-        """Reset the game state to allow player to play again."""
+    def start_game(self, seed=None):
+        """Reset the game state to allow player to play again. The new game
+        is played using the given seed, or else the next one from
+        self.seeds, and the seed used is stored as self.seed."""
+        if seed is None:
+            seed = self.seeds.getrandbits(64)
+        self.seed = seed
+        self.rng.seed(seed)
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+        if self.record_dir:
+            from flying_robots.replay import ReplayWriter, replay_path
+            self.recorder = ReplayWriter(replay_path(self.record_dir, seed),
+                    self.config, seed)
         self.score = 0
         self.wait_bonus = 0
         self.play_level(self.start_level)
     
-    def teleport_player(self):
-        self.grid.player.teleport()
-        self.grid.place_char(self.grid.player)
-        self.grid.move_enemies()
-        if not self.sticky_view:
-            self.elev = self.grid.player.coords[2]
-    
+    def teleport_player(self, safe=False):
+        self._raise_for(self.step(SAFE_TELEPORT if safe else TELEPORT))
+
     def move_player(self, dx, dy, dz, safe_only=True):
-        # This isn't absolutely ideal, but it allows for the player to move
-        # as far as possible in the given direction if self.move_afap=True.
+        self._raise_for(self._step(self.move_action(dx, dy, dz), safe_only))
+
+    def move_action(self, dx, dy, dz):
+        """Returns the action for moving the player in the given direction,
+        which is a move as far as possible if self.move_afap=True (and which
+        resets self.move_afap)."""
         afap = self.move_afap
-        move_it = True
-        while move_it:
-            try:
-                self.grid.player.move(dx, dy, dz, safe_only)
-            except BadTileError:
-                break
-            self.grid.place_char(self.grid.player)
-            self.grid.move_enemies()
-            if not self.sticky_view:
-                self.elev = self.grid.player.coords[2]
-            move_it = afap
         self.move_afap = False
-    
+        return move_action(dx, dy, dz, afap)
+
     def wait(self):
+        self._raise_for(self.step(WAIT))
+
+    def _raise_for(self, result):
+        """Raises GameOver or LevelComplete if the turn(s) described by
+        result ended the level, as the UIs expect."""
+        if result.player_dead:
+            raise GameOver(False, 'You died!')
+        elif result.level_complete:
+            raise LevelComplete
+
+    def step(self, action):
+        """Carries out a single action (see flying_robots.actions) and
+        returns a TurnResult. Unlike move_player, teleport_player and wait,
+        this never raises GameOver or LevelComplete, so it is up to the
+        caller to check the result and call next_level or start_game."""
+        return self._step(action)
+
+    def _step(self, action, safe_only=True):
+        if stats.enabled:
+            stats.begin_action()
+        if self.recorder is not None:
+            self.recorder.before_step(self)
+        result = TurnResult()
+        score = self.score + self.wait_bonus
+        enemies = self.enemy_count
+        if action == WAIT:
+            self._wait(result)
+        elif action in (TELEPORT, SAFE_TELEPORT):
+            result.moved = self._teleport(result, action == SAFE_TELEPORT)
+        elif is_move(action):
+            self._move(result, *decode_move(action), safe_only=safe_only)
+        else:
+            raise ValueError('Unknown action: {}'.format(action))
+        self._teleport_if_stuck(result)
+        result.kills = enemies - self.enemy_count
+        result.score = self.score + self.wait_bonus - score
+        if self.recorder is not None:
+            self.recorder.record(action)
+        if stats.enabled:
+            stats.end_action(result.turns)
+        return result
+
+    def _end_turn(self, result):
+        """Moves the enemies once the player has moved, and records the
+        outcome in result."""
+        self._record(result, self.grid.enemies_turn(), 1)
+        if not self.sticky_view:
+            self.elev = self.grid.player.coords[2]
+
+    def _record(self, result, outcome, turns):
+        result.turns += turns
+        result.level_complete = (outcome == LEVEL_COMPLETE)
+        result.player_dead = (outcome == PLAYER_DEAD)
+
+    def _move(self, result, dx, dy, dz, afap, safe_only):
+        if afap and safe_only:
+            outcome, turns = self.grid.move_player_afap(dx, dy, dz)
+            result.moved = bool(turns)
+            self._record(result, outcome, turns)
+            if not self.sticky_view:
+                self.elev = self.grid.player.coords[2]
+            return
+        player = self.grid.player
+        while not result.over and player.try_move(dx, dy, dz, safe_only):
+            result.moved = True
+            self.grid.place_char(player)
+            self._end_turn(result)
+            if not afap:
+                break
+
+    def _teleport(self, result, safe):
+        """Teleports the player and moves the enemies. Returns False if there
+        was nowhere to teleport to."""
+        try:
+            self.grid.player.teleport(safe)
+        except BadTileError:
+            return False
+        self.grid.place_char(self.grid.player)
+        self._end_turn(result)
+        return True
+
+    def _teleport_if_stuck(self, result):
+        """If auto-teleport is on, teleports the player to a safe tile (if
+        there is one) for as long as the player has no safe move."""
+        while self.auto_teleport and not (self.waiting or result.over):
+            if self.grid.has_safe_move(self.grid.player.coords):
+                break
+            if not self._teleport(result, True):
+                break
+
+    def _wait(self, result):
+        # The player stays put until the level ends, earning a bonus for
+        # each enemy killed in the meantime.
         self.waiting = True
-        while True:
-            self.move_player(0, 0, 0, False)
+        result.moved = True
+        self._record(result, *self.grid.fast_forward())
     
     def play_level(self, level):
         self.level = level
@@ -62,9 +231,98 @@ class Game:
         self.sticky_view = False
         self.score += self.wait_bonus
         self.wait_bonus = 0
-        self.grid.populate(calc_enemies(self.level))
+        try:
+            self.grid.populate(calc_enemies(self.level))
+        except GridFullError:
+            if self.level == self.start_level:
+                raise
+            # The grid is too small for any more levels, so the player has
+            # beaten all the levels it can hold.
+            raise GameOver(True, 'You win! The grid is full.')
         self.elev = self.grid.player.coords[2]
 
+    def snapshot(self):
+        """Returns the state of the current game as a compact byte string,
+        which can be passed to restore."""
+        flags = ((WAITING if self.waiting else 0)
+                | (MOVE_AFAP if self.move_afap else 0)
+                | (STICKY_VIEW if self.sticky_view else 0))
+        tiles, codes = self.grid.dump_entities()
+        version, internal, gauss = self.rng.getstate()
+        return b''.join((
+                _snapshot_state.pack(self.level, self.score, self.wait_bonus,
+                        self.elev, flags, len(codes)),
+                _snapshot_rng.pack(version, *internal, gauss is not None,
+                        gauss or 0.0),
+                tiles,
+                codes
+                ))
+
+    def restore(self, data):
+        """Restores the state of a game from a snapshot. The grid is rebuilt
+        from scratch, and the game carries on exactly as the game the
+        snapshot was taken from would have done."""
+        view = memoryview(data)
+        (self.level, self.score, self.wait_bonus, self.elev, flags,
+                n) = _snapshot_state.unpack_from(view)
+        rng = _snapshot_rng.unpack_from(view, _snapshot_state.size)
+        gauss = rng[-1] if rng[-2] else None
+        self.rng.setstate((rng[0], rng[1:-2], gauss))
+        self.waiting = bool(flags & WAITING)
+        self.move_afap = bool(flags & MOVE_AFAP)
+        self.sticky_view = bool(flags & STICKY_VIEW)
+        start = _snapshot_state.size + _snapshot_rng.size
+        self.grid.load_entities(view[start:start+4*n],
+                bytes(view[start+4*n:start+5*n]))
+
+    def save(self, path):
+        """Saves the current game to a file, from which it can be loaded
+        with load."""
+        x, y, z = self.grid_size
+        seed = str(self.seed).encode('ascii')
+        with open(path, 'wb') as f:
+            f.write(_save_header.pack(SAVE_MAGIC, SAVE_VERSION, x, y, z,
+                    len(seed)))
+            f.write(seed)
+            f.write(self.snapshot())
+
+    def load(self, path):
+        """Loads a game saved with save, replacing the current game. If the
+        saved game's grid is a different size, a new grid of that size is
+        made."""
+        with open(path, 'rb') as f:
+            data = f.read()
+        try:
+            magic, version, x, y, z, n = _save_header.unpack_from(data)
+        except struct.error:
+            raise BadSaveError('Saved game file is truncated.')
+        if magic != SAVE_MAGIC:
+            raise BadSaveError('Not a saved game: {}'.format(path))
+        if version != SAVE_VERSION:
+            raise BadSaveError('Unsupported saved game version.')
+        # The rest of the file is checked before anything is changed, so that
+        # a bad file can't leave the game half loaded.
+        start = _save_header.size
+        body = memoryview(data)[start+n:]
+        if len(data) < start + n or snapshot_size(body) != len(body):
+            raise BadSaveError('Saved game file is the wrong length.')
+        try:
+            seed = int(data[start:start+n])
+        except ValueError:
+            raise BadSaveError('Bad seed in saved game file.')
+        if [x, y, z] != self.grid_size:
+            self.grid_size = [x, y, z]
+            self.grid = type(self.grid)(x, y, z, self, self.rng)
+            for callback in self.subscribers:
+                self.grid.subscribe(callback)
+        # The game carries on from a different point, so any recording of
+        # the game so far can't be continued.
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+        self.seed = seed
+        self.restore(body)
+
     def next_level(self):
         self.play_level(self.level+1)
     
@@ -80,6 +338,31 @@ class Game:
     def view_grid(self):
         return self.grid.view_plan(self.elev)
 
+    def subscribe(self, callback):
+        """Calls callback with each of the grid's change sets (see
+        GameGrid.subscribe) from now on."""
+        self.subscribers.append(callback)
+        self.grid.subscribe(callback)
+
+    def unsubscribe(self, callback):
+        self.subscribers.remove(callback)
+        self.grid.unsubscribe(callback)
+
+    def take_changes(self):
+        """Returns the tiles which have changed since the interface last
+        asked (see GameGrid.take_changes)."""
+        return self.grid.take_changes()
+
+    def view_codes(self):
+        """Returns the class codes of the tiles on the level being viewed
+        (see GameGrid.plane_codes)."""
+        return self.grid.plane_codes(self.elev)
+
+    def view_occupants(self):
+        """Returns the occupants of the level being viewed (see
+        GameGrid.occupants)."""
+        return self.grid.occupants(self.elev)
+
     @property
     def objects(self):
         return self.grid.objects
@@ -90,4 +373,4 @@ class Game:
     
     @property
     def enemy_count(self):
-        return len(self.grid.enemies)
+        return self.grid.enemy_count
@@ -1,10 +1,35 @@
 import random
-from copy import deepcopy
-from itertools import product
-from operator import add
+import sys
+from array import array
+from itertools import product, count
 
-from flying_robots.chars import Player, Robot, Junk, gameclass
-from flying_robots.exceptions import BadTileError, LevelComplete, GameOver
+from flying_robots import stats
+from flying_robots.chars import (Player, Robot, Junk, gameclass, gamecode,
+        ROBOT, PLAYER)
+from flying_robots.exceptions import (BadTileError, GridFullError,
+        LevelComplete, GameOver)
+
+# The names of the available grid backends, which can be selected using the
+# "backend" option in the "grid" section of the config.
+grid_backends = ('list', 'array', 'sparse')
+DEFAULT_BACKEND = 'list'
+
+# The offsets of a tile's neighbours, including the tile itself.
+neighbours = tuple(product((-1, 0, 1), repeat=3))
+
+# The possible outcomes of a turn, as returned by GameGrid.enemies_turn.
+PLAYING, LEVEL_COMPLETE, PLAYER_DEAD = range(3)
+
+# The kinds of events in the grid's change sets (see GameGrid.subscribe).
+MOVED, DESTROYED, JUNKED, PLAYER_DIED, LEVEL_CLEARED, RESET = range(6)
+
+# The number of random empty tiles tried when looking for a safe tile, before
+# falling back to finding every safe tile on the grid.
+SAFE_TRIES = 1000
+
+# The number of tiles in each block of the free tile index (see
+# GameGrid.reset_free_except). It must be a power of two.
+FREE_BLOCK = 256
 
 class GameGrid:
     
@@ -20,91 +45,457 @@ class GameGrid:
     The grid handles character placement, movement and collisions."""
 
     
-    def __init__(self, x, y, z, game):
+    def __init__(self, x, y, z, game, rng=None):
         self.game = game
-        self.grid = self.get_empty_grid(x, y, z)
-        self.objects = set()
+        # All of the grid's random choices are made using self.rng, so that
+        # they can be reproduced by seeding it.
+        self.rng = rng or random.Random()
+        self.serials = count()
         self.x = x
         self.y = y
         self.z = z
+        # Change sets are only collected once something subscribes to them.
+        self.subscribers = []
+        self.events = None
+        self.changes = None
+        self.all_changed = False
+        self.grid = self.get_empty_grid(x, y, z)
     
     def get_empty_grid(self, x, y, z):
         """Creates an empty grid of the appropriate dimensions and
         binds it to the current instance."""
-        return [[[None for i in range(x)] for j in range(y)] for k in range(z)]
+        self.reset_free_except([], x * y * z)
+        self.planes = [{} for k in range(z)]
+        return [[[None] * x for j in range(y)] for k in range(z)]
     
     def clear_grid(self):
-        for obj in self.objects:
-            self.clear_tile(obj.coords)
+        self.grid = self.get_empty_grid(self.x, self.y, self.z)
     
     def clear_tile(self, coords):
         self.set_tile(coords, None)
     
     def set_tile(self, coords, new):
-        incumbent = gameclass(self.get_tile(coords))
+        incumbent = self.get_tile(coords)
         x, y, z = coords
         self.grid[z][y][x] = new
+        if (incumbent is None) and (new is not None):
+            self.take_free(self.to_index(coords))
+        elif (incumbent is not None) and (new is None):
+            self.add_free(self.to_index(coords))
+        if new is None:
+            self.planes[z].pop(y * self.x + x, None)
+        else:
+            self.planes[z][y * self.x + x] = new
+
+    # Anything which needs to know what happens on the grid (an interface,
+    # for example) can subscribe to its change sets. A change set is a list
+    # of events, each a tuple beginning with the kind of event (see MOVED
+    # etc, above), and one is published at the end of each turn, or of each
+    # run of turns played together by run_turns. The tiles in events are
+    # linear indices.
+    #
+    # - (MOVED, old, new): a character moved from old to new;
+    # - (DESTROYED, tile): the robot last reported on tile was destroyed
+    #   (after moving there, or somewhere on the way from there, for turns
+    #   played together);
+    # - (JUNKED, tile): junk was left on tile;
+    # - (PLAYER_DIED, tile) and (LEVEL_CLEARED,): the turn's outcome;
+    # - (RESET,): the grid was repopulated or loaded, so everything on it
+    #   should be treated as new. This is published straight away.
+    #
+    # While no one is subscribed, self.events is None and no events are
+    # made.
+
+    def subscribe(self, callback):
+        """Calls callback with each change set (a list of events) from now
+        on."""
+        self.subscribers.append(callback)
+        if self.events is None:
+            self.events = []
+
+    def unsubscribe(self, callback):
+        self.subscribers.remove(callback)
+        if not self.subscribers:
+            self.events = None
+
+    def publish(self):
+        events, self.events = self.events, []
+        for callback in self.subscribers:
+            callback(events)
+
+    def note_move(self, old, new):
+        """Adds a MOVED event for a character moving from old to new (which
+        are coords), if they differ."""
+        if old != new:
+            x, y = self.x, self.y
+            self.events.append((MOVED, (old[2] * y + old[1]) * x + old[0],
+                    (new[2] * y + new[1]) * x + new[0]))
+
+    def publish_outcome(self, outcome):
+        """Adds the events for the outcome of a turn (or turns) and
+        publishes the change set."""
+        if outcome == PLAYER_DEAD:
+            self.events.append((PLAYER_DIED,
+                    self.to_index(self.player.coords)))
+        elif outcome == LEVEL_COMPLETE:
+            self.events.append((LEVEL_CLEARED,))
+        self.publish()
+
+    def publish_reset(self):
+        # Any events not yet published are about the grid as it was, so they
+        # are dropped.
+        self.events = [(RESET,)]
+        self.publish()
+
+    # The interfaces find out which tiles have changed since they last drew
+    # the grid with take_changes, which collects the tiles in the events of
+    # each change set. self.all_changed is set when the grid is reset.
+
+    def take_changes(self):
+        """Returns a set of the linear indices of the tiles which have
+        changed since the last call, or None if every tile should be
+        treated as changed (on the first call, and after the grid has been
+        repopulated or loaded)."""
+        if self.changes is None:
+            self.changes = set()
+            self.subscribe(self.collect_changes)
+            return None
+        changes, self.changes = self.changes, set()
+        if self.all_changed:
+            self.all_changed = False
+            return None
+        return changes
+
+    def collect_changes(self, events):
+        for event in events:
+            if event[0] == RESET:
+                self.all_changed = True
+            else:
+                self.changes.update(event[1:])
+
+    # The grid also keeps an index of the occupants of each z-level, so that
+    # the characters on one level can be found without looking at every
+    # tile or every character. self.planes[z] maps the index within the
+    # level (y * self.x + x) of each occupied tile on level z to its
+    # occupant.
+
+    def occupants(self, elev=None):
+        """Returns a dict mapping the index within the given z-level
+        (y * self.x + x) of each occupied tile on that level to its
+        occupant."""
+        if elev is None:
+            elev = self.player.coords[2]
+        return dict(self.planes[elev])
+
+    # The grid keeps an index of the empty ("free") tiles, so that a random
+    # empty tile can be found without guessing. self.taken has a byte for
+    # each tile (by linear index), which is 1 if the tile is occupied, and
+    # the tiles are split into blocks of FREE_BLOCK tiles. The number of
+    # free tiles in each block is kept in a Fenwick tree (self.free_tree),
+    # so that both updating a block's count and finding the block holding
+    # the nth free tile take time logarithmic in the number of blocks. The
+    # tile is then found by halving that block until only it is left,
+    # counting the free tiles in one half each time. Random empty tiles are
+    # therefore drawn from the free tiles in order of their linear index,
+    # so which tile is drawn depends only on which tiles are occupied, and
+    # not on the order they were filled and emptied in. A game restored
+    # from a snapshot then plays on exactly as the original would.
+
+    def reset_free_except(self, occupied, volume):
+        """Rebuilds the free tile index, given a sorted list of the
+        occupied tiles."""
+        self.taken = taken = bytearray(volume)
+        for tile in occupied:
+            taken[tile] = 1
+        # Element i of the tree (counting from 1) holds the total of the
+        # counts of the i & -i blocks up to and including block i-1.
+        tree = [0]
+        tree.extend(min(FREE_BLOCK, volume - start)
+                - taken.count(1, start, start + FREE_BLOCK)
+                for start in range(0, volume, FREE_BLOCK))
+        size = len(tree)
+        for i in range(1, size):
+            parent = i + (i & -i)
+            if parent < size:
+                tree[parent] += tree[i]
+        self.free_tree = tree
+        # The largest power of two no greater than the number of blocks,
+        # which is where nth_free starts its search.
+        self.free_top = 1 << ((size - 1).bit_length() - 1) if size > 1 else 0
+        self.n_free = volume - len(occupied)
+
+    # add_free and take_free are called for almost every move, so each
+    # updates the tree itself rather than calling a shared method.
+
+    def add_free(self, index):
+        self.taken[index] = 0
+        tree = self.free_tree
+        size = len(tree)
+        i = index // FREE_BLOCK + 1
+        while i < size:
+            tree[i] += 1
+            i += i & -i
+        self.n_free += 1
+
+    def take_free(self, index):
+        self.taken[index] = 1
+        tree = self.free_tree
+        size = len(tree)
+        i = index // FREE_BLOCK + 1
+        while i < size:
+            tree[i] -= 1
+            i += i & -i
+        self.n_free -= 1
+
+    def nth_free(self, n):
+        """Returns the linear index of the nth free tile (counting from
+        zero), in order of linear index."""
+        tree = self.free_tree
+        size = len(tree)
+        # Find the last block whose preceding blocks have no more than n free
+        # tiles between them, by descending the tree.
+        block = 0
+        step = self.free_top
+        while step:
+            i = block + step
+            if i < size and tree[i] <= n:
+                block = i
+                n -= tree[i]
+            step >>= 1
+        taken = self.taken
+        start = block * FREE_BLOCK
+        width = FREE_BLOCK
+        while width > 1:
+            width //= 2
+            free = width - taken.count(1, start, start + width)
+            if free <= n:
+                n -= free
+                start += width
+        return start
 
     def get_tile(self, coords):
         x, y, z = coords
         try:
+            if min(x, y, z) < 0:
+                # Negative indices would otherwise wrap around to the far
+                # side of the grid.
+                raise IndexError
             return self.grid[z][y][x]
         except IndexError:
             raise BadTileError('Cannot get tile at {},{},{}: Tile not in grid'.format(x, y, z))
     
+    def to_index(self, coords):
+        """Takes coords and returns the linear index of that tile, counting
+        along the x-axis, then the y-axis, then the z-axis."""
+        x, y, z = coords
+        if not ((0 <= x < self.x) and (0 <= y < self.y) and (0 <= z < self.z)):
+            raise BadTileError('Tile {},{},{} not in grid'.format(x, y, z))
+        return (z * self.y + y) * self.x + x
+
+    def to_coords(self, index):
+        """The inverse of to_index."""
+        yz, x = divmod(index, self.x)
+        z, y = divmod(yz, self.y)
+        return [x, y, z]
+
+    def sample_tiles(self, n):
+        """Returns the linear indices of n distinct tiles, chosen at random.
+        Raises GridFullError if the grid has fewer than n tiles."""
+        volume = self.x * self.y * self.z
+        if n > volume:
+            raise GridFullError('Cannot fit {} characters in a grid of {} '
+                    'tiles.'.format(n, volume))
+        return self.rng.sample(range(volume), n)
+
     def get_random_coords(self):
         coords = [
-            random.randint(0, self.x-1),
-            random.randint(0, self.y-1),
-            random.randint(0, self.z-1)
+            self.rng.randint(0, self.x-1),
+            self.rng.randint(0, self.y-1),
+            self.rng.randint(0, self.z-1)
             ]
         return coords
     
     def get_random_empty_coords(self):
-        while True:
-            coords = self.get_random_coords()
-            if self.tile_is_empty(coords):
+        if not self.n_free:
+            raise BadTileError('No empty tiles.')
+        return self.to_coords(self.nth_free(self.rng.randrange(self.n_free)))
+
+    def get_random_safe_coords(self):
+        """Returns the coords of a random empty tile with no robot next to
+        it, or None if there is no such tile. Random empty tiles are tried
+        first, and every safe tile is only found if none of those is safe,
+        so the tile is drawn uniformly from the safe tiles either way."""
+        if not self.n_free:
+            return None
+        for _ in range(SAFE_TRIES):
+            coords = self.to_coords(
+                    self.nth_free(self.rng.randrange(self.n_free)))
+            if self.tile_is_safe(coords):
                 return coords
+        safe = self.safe_tiles()
+        if safe:
+            return self.to_coords(safe[self.rng.randrange(len(safe))])
+
+    def safe_tiles(self):
+        """Returns the linear indices of all the empty tiles with no robot
+        next to them, in order."""
+        # Rather than checking each tile's neighbours, mark the tiles next
+        # to each robot as unsafe, along with the occupied tiles.
+        unsafe = bytearray(self.taken)
+        X, Y, Z = self.x, self.y, self.z
+        for e in self.enemies:
+            x, y, z = e.coords
+            for dx, dy, dz in neighbours:
+                nx, ny, nz = x+dx, y+dy, z+dz
+                if (0 <= nx < X) and (0 <= ny < Y) and (0 <= nz < Z):
+                    unsafe[(nz * Y + ny) * X + nx] = 1
+        safe = []
+        i = unsafe.find(0)
+        while i != -1:
+            safe.append(i)
+            i = unsafe.find(0, i + 1)
+        return safe
     
     def tile_is_empty(self, coords):
         return gameclass(self.get_tile(coords)) == 'empty'
     
+    # Unlike ArrayGrid, this grid keeps no danger map, so tile_is_safe looks
+    # at each of the tile's neighbours. Keeping one up to date costs more per
+    # turn on this grid than the lookups it saves.
+
     def tile_is_safe(self, coords):
-        # TODO: Don't do this call to product every time. Generate neighbours
-        # once and reuse it.
-        # Maybe create a separate get_neighbours func, which takes coords
-        # and returns list of absolute coords of neighbours.
-        neighbours = product((-1, 0, 1), repeat=3)
-        for n in neighbours:
+        x, y, z = coords
+        for dx, dy, dz in neighbours:
             try:
-                gc = gameclass(self.get_tile(map(add, coords, n)))
+                gc = gameclass(self.get_tile((x+dx, y+dy, z+dz)))
             except BadTileError:
                 # Tile is out of bounds, and therefore not dangerous.
                 continue
             if gc == 'robot':
                 return False
         return True
+
+    def safe_moves(self, coords):
+        """Returns the offsets of the moves (including staying put) which
+        the player, at coords, could make onto an empty tile that is safe."""
+        x, y, z = coords
+        # Only robots within two tiles of the player can make a move unsafe,
+        # so find those first.
+        near = [(i, j, k)
+                for k in range(max(z-2, 0), min(z+3, self.z))
+                for j in range(max(y-2, 0), min(y+3, self.y))
+                for i in range(max(x-2, 0), min(x+3, self.x))
+                if gameclass(self.grid[k][j][i]) == 'robot']
+        moves = []
+        for dx, dy, dz in neighbours:
+            nx, ny, nz = x+dx, y+dy, z+dz
+            if not ((0 <= nx < self.x) and (0 <= ny < self.y)
+                    and (0 <= nz < self.z)):
+                continue
+            if (dx or dy or dz) and self.grid[nz][ny][nx] is not None:
+                continue
+            if any(abs(i-nx) <= 1 and abs(j-ny) <= 1 and abs(k-nz) <= 1
+                    for i, j, k in near):
+                continue
+            moves.append((dx, dy, dz))
+        return moves
+
+    def has_safe_move(self, coords):
+        """Returns True if the player, at coords, has at least one move
+        (including staying put) onto an empty tile that is safe."""
+        x, y, z = coords
+        for dx, dy, dz in neighbours:
+            new = [x+dx, y+dy, z+dz]
+            stay = (dx == dy == dz == 0)
+            try:
+                if (stay or self.tile_is_empty(new)) and self.tile_is_safe(new):
+                    return True
+            except BadTileError:
+                continue
+        return False
     
     def is_valid_tile(self, coords):
         x, y, z = coords
-        return (min(coords) >= 0) and (x <= self.x) and (y <= self.y) and (z <= self.z)
+        return (min(coords) >= 0) and (x < self.x) and (y < self.y) and (z < self.z)
     
     def populate(self, enemies):
+        # All characters are placed with a single draw of distinct tiles, so
+        # that placement never has to retry on an occupied tile. The last
+        # tile drawn goes to the player.
+        tiles = self.sample_tiles(enemies + 1)
         self.clear_grid()
-        _enemies = set()
-        while enemies:
-            coords = self.get_random_empty_coords()
-            robot = Robot(coords, self)
-            _enemies.add(robot)
-            self.set_tile(coords, robot)
-            enemies -= 1
-        self.enemies = _enemies
-        self.objects = _enemies.copy()
-        coords = self.get_random_empty_coords()
-        self.player = Player(coords, self)
-        self.set_tile(coords, self.player)
+        self.serials = count()
+        self.player = Player(self.to_coords(tiles.pop()), self)
+        self.set_tile(self.player.coords, self.player)
+        self.enemies = set()
+        for t in tiles:
+            robot = Robot(self.to_coords(t), self)
+            self.enemies.add(robot)
+            self.set_tile(robot.coords, robot)
+        self.objects = self.enemies.copy()
         self.objects.add(self.player)
+        if self.events is not None:
+            self.publish_reset()
     
+    @property
+    def enemy_count(self):
+        return len(self.enemies)
+
+    # A grid's entities can be saved as two byte strings: the linear index
+    # of each entity's tile, as little-endian 32-bit integers, and each
+    # entity's class code. The player comes first, followed by the robots
+    # and junk in order of their tiles, so a grid's entities always dump
+    # the same way whatever order they were placed in.
+
+    def dump_entities(self):
+        player = self.to_index(self.player.coords)
+        others = sorted((self.to_index(o.coords), gamecode(o))
+                for o in self.objects if o is not self.player)
+        tiles = array('I', [player])
+        tiles.extend(t for t, _ in others)
+        if sys.byteorder == 'big':
+            tiles.byteswap()
+        return tiles.tobytes(), bytes([PLAYER] + [c for _, c in others])
+
+    def load_entities(self, tiles, codes):
+        """Replaces the grid's entities with those dumped by
+        dump_entities."""
+        index = array('I')
+        index.frombytes(tiles)
+        if sys.byteorder == 'big':
+            index.byteswap()
+        self.clear_entities(sorted(index))
+        self.serials = count()
+        self.player = Player(self.to_coords(index[0]), self)
+        self.enemies = set()
+        self.objects = {self.player}
+        for t, code in zip(index[1:], codes[1:]):
+            obj = (Robot if code == ROBOT else Junk)(self.to_coords(t), self)
+            self.objects.add(obj)
+            if code == ROBOT:
+                self.enemies.add(obj)
+        for obj in self.objects:
+            self.put_entity(obj)
+        if self.events is not None:
+            self.publish_reset()
+
+    def clear_entities(self, occupied):
+        """Removes all the entities from the grid, for load_entities to
+        place new ones on the tiles in occupied (a sorted list of linear
+        indices). The old entities' tiles are cleared and the free tile
+        index is rebuilt directly, rather than one tile at a time."""
+        for obj in getattr(self, 'objects', ()):
+            ox, oy, oz = obj.coords
+            self.grid[oz][oy][ox] = None
+        self.reset_free_except(occupied, self.x * self.y * self.z)
+        self.planes = [{} for k in range(self.z)]
+
+    def put_entity(self, obj):
+        """Puts obj on its tile, without updating the free tile index."""
+        x, y, z = obj.coords
+        self.grid[z][y][x] = obj
+        self.planes[z][y * self.x + x] = obj
+
     def place_char(self, new):
         coords = new.coords
         incumbent = self.get_tile(coords)
@@ -132,20 +523,34 @@ class GameGrid:
             j = Junk(coords, self)
             self.set_tile(coords, j)
             self.objects.add(j)
+            if self.events is not None:
+                tile = self.to_index(coords)
+                self.events.extend(((DESTROYED, tile), (DESTROYED, tile),
+                        (JUNKED, tile)))
         elif incumbent_cls == 'junk':
             self.kill(new)
+            if self.events is not None:
+                self.events.append((DESTROYED, self.to_index(coords)))
     
     def kill(self, enemy):
         # Killed object is not removed from self.enemies until after
         # all enemies have moved, as the size of the set cannot be changed
         # during iteration.
         enemy.is_alive = False
+        self.score_kills(enemy.__killscore__)
+
+    def score_kills(self, killscore, count=1):
+        """Adds the score for killing count enemies worth killscore each.
+        Enemies killed while the player is waiting count towards the wait
+        bonus instead."""
         if self.game.waiting:
-            self.game.wait_bonus += int(enemy.__killscore__ * 1.1)
+            self.game.wait_bonus += int(killscore * 1.1) * count
         else:
-            self.game.score += enemy.__killscore__
+            self.game.score += killscore * count
 
-    def move_enemies(self):
+    def enemies_turn(self):
+        """Moves all the enemies, and returns the outcome of the turn:
+        PLAYER_DEAD, LEVEL_COMPLETE or PLAYING."""
         # Moving enemies has several stages.
         # - Each enemy decides where it wants to move, and adjusts its
         #   internally stored coords (obj.coords) accordingly.
@@ -155,18 +560,159 @@ class GameGrid:
         #   placed in its new position on the grid.
         #   Collisions are handled at this point.
         # - Dead enemies are removed from self.enemies.
+        timed = stats.enabled
+        if timed:
+            decided = stats.clock()
         for e in self.enemies:
             e.move()
+        if timed:
+            placed = stats.clock()
         for e in self.enemies:
             self.place_char(e)
-        if not self.player.is_alive:
-            raise GameOver(False, 'You died!')
+        if timed:
+            cleaned = stats.clock()
+            robots = len(self.enemies)
         dead_enemies = {e for e in self.enemies if not e.is_alive}
         self.enemies.difference_update(dead_enemies)
         self.objects.difference_update(dead_enemies)
-        if not self.enemies:
+        if timed:
+            stats.record_turn(decided, placed, cleaned, stats.clock(), robots)
+        if not self.player.is_alive:
+            outcome = PLAYER_DEAD
+        elif not self.enemies:
+            outcome = LEVEL_COMPLETE
+        else:
+            outcome = PLAYING
+        if self.events is not None:
+            self.publish_outcome(outcome)
+        return outcome
+
+    def move_enemies(self):
+        """Moves all the enemies, raising GameOver if the player dies or
+        LevelComplete if no enemies are left."""
+        outcome = self.enemies_turn()
+        if outcome == PLAYER_DEAD:
+            raise GameOver(False, 'You died!')
+        elif outcome == LEVEL_COMPLETE:
             raise LevelComplete
 
+    def fast_forward(self):
+        """Moves the enemies until the level ends, with the player staying
+        put, and returns the outcome and the number of turns that passed.
+        This gives the same result as calling enemies_turn repeatedly."""
+        return self.run_turns()
+
+    def move_player_afap(self, dx, dy, dz):
+        """Moves the player by dx, dy, dz for as long as the next tile is
+        empty and safe, with the enemies moving after each step. Returns the
+        outcome of the last turn and the number of turns that passed (zero
+        if the player could not move at all)."""
+        return self.run_turns((dx, dy, dz))
+
+    def run_turns(self, step=None):
+        """Plays turns until the level ends, with the player either staying
+        put (if step is None) or moving by step each turn, stopping before
+        any move onto an occupied or unsafe tile. Returns the outcome and
+        the number of turns played.
+
+        The player's and enemies' coords are tracked as plain tuples, and
+        the grid is only updated once, at the end."""
+        old = self.player.coords
+        px, py, pz = old
+        if step is not None:
+            # Check the first step before doing any other work, as AFAP
+            # moves are often blocked straight away.
+            if not self.player.can_move(*step, safe_only=True):
+                return PLAYING, 0
+        if stats.enabled:
+            start = stats.clock()
+        robots = {tuple(e.coords): e for e in self.enemies}
+        junk = {tuple(o.coords) for o in self.objects
+                if gameclass(o) == 'junk'}
+        crashes = set()
+        turns = 0
+        outcome = PLAYING
+        while outcome == PLAYING:
+            if step is not None:
+                dx, dy, dz = step
+                new = (px + dx, py + dy, pz + dz)
+                if not self.is_valid_tile(new) or new in junk:
+                    break
+                nx, ny, nz = new
+                if any((nx + ox, ny + oy, nz + oz) in robots
+                        for ox, oy, oz in neighbours):
+                    break
+                px, py, pz = new
+            player = (px, py, pz)
+            turns += 1
+            arrivals = {}
+            crowded = set()
+            for (x, y, z), robot in robots.items():
+                new = (x + (x < px) - (x > px), y + (y < py) - (y > py),
+                        z + (z < pz) - (z > pz))
+                if new in arrivals:
+                    crowded.add(new)
+                else:
+                    arrivals[new] = robot
+            survivors = {t: r for t, r in arrivals.items()
+                    if not (t in crowded or t in junk)}
+            crowded -= junk
+            junk |= crowded
+            crashes |= crowded
+            self.score_kills(Robot.__killscore__, len(robots) - len(survivors))
+            robots = survivors
+            if player in arrivals:
+                self.player.is_alive = False
+                outcome = PLAYER_DEAD
+            elif not robots:
+                outcome = LEVEL_COMPLETE
+        if stats.enabled:
+            stats.record_batch(start, turns, len(self.enemies))
+        if not turns:
+            return outcome, turns
+        survivors = set(robots.values())
+        if self.events is not None:
+            self.note_batch(old, [px, py, pz], robots, crashes)
+        self.clear_tile(old)
+        for e in self.enemies:
+            self.clear_tile(e.coords)
+            if e not in survivors:
+                e.is_alive = False
+                self.objects.discard(e)
+        self.enemies = survivors
+        self.player.coords = [px, py, pz]
+        if self.player.is_alive:
+            self.set_tile(self.player.coords, self.player)
+        for t in crashes:
+            j = Junk(list(t), self)
+            self.set_tile(j.coords, j)
+            self.objects.add(j)
+        for t, e in robots.items():
+            e.coords = list(t)
+            self.set_tile(e.coords, e)
+        if self.events is not None:
+            self.publish_outcome(outcome)
+        return outcome, turns
+
+    def note_batch(self, old, new, robots, crashes):
+        """Adds the events for turns played together by run_turns, given
+        the player's old and new coords, a dict mapping the tiles of the
+        surviving robots to the robots and the tiles where junk was left.
+        Robots which were destroyed are reported at the tiles they started
+        from."""
+        self.note_move(old, new)
+        events = self.events
+        moved = {e: t for t, e in robots.items()}
+        for e in self.enemies:
+            start = self.to_index(e.coords)
+            if e in moved:
+                end = self.to_index(moved[e])
+                if end != start:
+                    events.append((MOVED, start, end))
+            else:
+                events.append((DESTROYED, start))
+        events.extend((JUNKED, self.to_index(t)) for t in crashes)
+
     # Player can only view one "floor" of the grid at a time, and always views
     # the grid in plan. Player can cycle between floors at will.
     
@@ -175,4 +721,27 @@ class GameGrid:
             elev = self.player.coords[2]
         plan = self.grid[elev]
         return plan
-    
+
+    def plane_codes(self, elev=None):
+        """Returns the class codes (see flying_robots.chars) of the tiles on
+        the given z-level, row by row, as a bytes object of length x*y."""
+        if elev is None:
+            elev = self.player.coords[2]
+        codes = bytearray(self.x * self.y)
+        for i, obj in self.planes[elev].items():
+            codes[i] = gamecode(obj)
+        return bytes(codes)
+
+def get_grid_class(backend=DEFAULT_BACKEND):
+    """Takes the name of a grid backend and returns the class implementing
+    it. The array backend is imported lazily, as it depends on numpy."""
+    if backend == 'array':
+        from flying_robots.arraygrid import ArrayGrid
+        return ArrayGrid
+    elif backend == 'sparse':
+        from flying_robots.sparsegrid import SparseGrid
+        return SparseGrid
+    elif backend == 'list':
+        return GameGrid
+    else:
+        raise ValueError('Unknown grid backend: {}'.format(backend))
@@ -0,0 +1,285 @@
+"""Recording and replaying games.
+
+A replay holds everything needed to play a game again exactly as it was
+played: the config it was played with, the seed it was started with, and
+the player's actions (see flying_robots.actions), one byte per action.
+Levels are moved on to automatically when they are completed, so they
+don't need to be recorded.
+
+Every so often (every KEYFRAME_INTERVAL actions by default), a snapshot of
+the whole state of the game (see Game.snapshot), called a keyframe, is
+recorded before the next action. To see the game as it was at any point, a
+replay only has to be played forward from the keyframe before it (see
+ReplayCursor). A game restored from a snapshot carries on exactly as the
+game the snapshot was taken from, so taking a keyframe doesn't change how
+the recording game plays.
+
+The file format is:
+
+- the magic bytes b'FRRP' and a version byte;
+- the seed and the config (in the format of a config file), each as a
+  little-endian 32-bit length followed by that many bytes of UTF-8;
+- the keyframe interval, N, as a little-endian 32-bit integer (0 if there
+  are no keyframes);
+- the actions, one byte each, to the end of the file. After every N
+  actions (if there are any more actions to come) there is a keyframe: the
+  byte KEYFRAME, the length of the snapshot as a little-endian 32-bit
+  integer and then the snapshot itself.
+
+Actions are written as they are played, through a buffered file, so
+recording costs next to nothing per turn. A game records itself if the
+"record_dir" option in the "game" section of the config is set (see
+Game.start_game), or a ReplayWriter can be attached to it as game.recorder
+straight after the game is started."""
+
+import atexit
+import struct
+from configparser import ConfigParser
+from io import StringIO
+from os import makedirs
+from os.path import join, exists
+from time import strftime
+
+from flying_robots.exceptions import GameOver
+from flying_robots.game import Game
+
+MAGIC = b'FRRP'
+# Replays recorded before version 3 drew random empty tiles in a different
+# way, so they can't be played back.
+VERSION = 3
+EXTENSION = '.frr'
+KEYFRAME = 0xff
+KEYFRAME_INTERVAL = 250
+
+_length = struct.Struct('<I')
+# bytes objects for each action, so that recording one doesn't create one.
+_action_bytes = [bytes((i,)) for i in range(256)]
+
+class BadReplayError(Exception): pass
+
+def _write_str(f, s):
+    data = s.encode('utf-8')
+    f.write(_length.pack(len(data)))
+    f.write(data)
+
+def _read_bytes(f):
+    header = f.read(_length.size)
+    if len(header) < _length.size:
+        raise BadReplayError('Replay file is truncated.')
+    n, = _length.unpack(header)
+    data = f.read(n)
+    if len(data) < n:
+        raise BadReplayError('Replay file is truncated.')
+    return data
+
+def _read_str(f):
+    return _read_bytes(f).decode('utf-8')
+
+def config_to_str(config):
+    s = StringIO()
+    config.write(s)
+    return s.getvalue()
+
+def config_from_str(s):
+    config = ConfigParser()
+    config.read_string(s)
+    return config
+
+def replay_path(record_dir, seed):
+    """Returns a new path in record_dir (which is created if necessary)
+    for the replay of a game started now with the given seed."""
+    makedirs(record_dir, exist_ok=True)
+    name = '{}-{}'.format(strftime('%Y%m%d-%H%M%S'), seed)
+    path = join(record_dir, name + EXTENSION)
+    n = 1
+    while exists(path):
+        path = join(record_dir, '{}-{}{}'.format(name, n, EXTENSION))
+        n += 1
+    return path
+
+class ReplayWriter:
+
+    """Writes the replay of a game to a file, as the game is played."""
+
+    def __init__(self, path, config, seed, interval=KEYFRAME_INTERVAL):
+        self.file = open(path, 'wb')
+        self.file.write(MAGIC + bytes((VERSION,)))
+        _write_str(self.file, str(seed))
+        _write_str(self.file, config_to_str(config))
+        self.file.write(_length.pack(interval))
+        self.interval = interval
+        self.actions = 0
+        atexit.register(self.close)
+
+    def before_step(self, game):
+        """Called by the game before each action, to record a keyframe if
+        one is due."""
+        if self.interval and self.actions and not (
+                self.actions % self.interval):
+            snapshot = game.snapshot()
+            self.file.write(_action_bytes[KEYFRAME])
+            self.file.write(_length.pack(len(snapshot)))
+            self.file.write(snapshot)
+
+    def record(self, action):
+        self.file.write(_action_bytes[action])
+        self.actions += 1
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+        atexit.unregister(self.close)
+
+class Replay:
+
+    """A recorded game. self.actions holds the actions, and self.keyframes
+    maps the number of actions before each keyframe to its snapshot."""
+
+    def __init__(self, config, seed, actions, keyframes=None):
+        self.config = config
+        self.seed = seed
+        self.actions = actions
+        self.keyframes = keyframes or {}
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise BadReplayError('Not a replay file: {}'.format(path))
+            if f.read(1) != bytes((VERSION,)):
+                raise BadReplayError('Unsupported replay version.')
+            seed = int(_read_str(f))
+            config = config_from_str(_read_str(f))
+            actions, keyframes = cls._read_actions(f)
+        # Playing the replay back shouldn't record it again.
+        config['game'].pop('record_dir', None)
+        return cls(config, seed, actions, keyframes)
+
+    @staticmethod
+    def _read_actions(f):
+        header = f.read(_length.size)
+        if len(header) < _length.size:
+            raise BadReplayError('Replay file is truncated.')
+        interval, = _length.unpack(header)
+        if not interval:
+            return f.read(), {}
+        chunks = []
+        keyframes = {}
+        n = 0
+        while True:
+            chunk = f.read(interval)
+            chunks.append(chunk)
+            n += len(chunk)
+            marker = f.read(1)
+            if not marker:
+                break
+            if marker[0] != KEYFRAME:
+                raise BadReplayError('Bad keyframe in replay file.')
+            keyframes[n] = _read_bytes(f)
+        return b''.join(chunks), keyframes
+
+    def __len__(self):
+        return len(self.actions)
+
+    def play(self, stop=None):
+        """Plays the game back, without an interface, up to (but not
+        including) action number stop, or to the end. Returns a
+        ReplayResult."""
+        cursor = ReplayCursor(self)
+        result = ReplayResult(cursor.game)
+        while cursor.position < (len(self) if stop is None else stop):
+            turn = cursor.step()
+            if turn is None:
+                break
+            result.actions += 1
+            result.turns += turn.turns
+        result.over = cursor.over
+        result.won = cursor.won
+        return result
+
+class ReplayCursor:
+
+    """Plays a replay back one action at a time, and can jump to any point
+    in it, backwards or forwards, by restoring the keyframe before that
+    point and playing on from there. self.game is the game, as it was
+    before action number self.position."""
+
+    def __init__(self, replay):
+        self.replay = replay
+        self.game = Game(replay.config, replay.seed)
+        self.position = 0
+        self.over = False
+        self.won = False
+
+    def __len__(self):
+        return len(self.replay)
+
+    def step(self):
+        """Plays the next action, and returns its TurnResult (or None if
+        the replay or the game is over)."""
+        if self.over or self.position >= len(self.replay):
+            return None
+        turn = self.game.step(self.replay.actions[self.position])
+        self.position += 1
+        if turn.player_dead:
+            self.over = True
+        elif turn.level_complete:
+            try:
+                self.game.next_level()
+            except GameOver:
+                self.over = self.won = True
+        return turn
+
+    def seek(self, position):
+        """Moves to the given position (the number of actions played),
+        which is limited to the length of the replay."""
+        position = max(0, min(position, len(self.replay)))
+        keyframe = max((k for k in self.replay.keyframes if k <= position),
+                default=0)
+        if position < self.position or keyframe > self.position:
+            if keyframe:
+                self.game.restore(self.replay.keyframes[keyframe])
+            else:
+                self.game.start_game(self.replay.seed)
+            self.position = keyframe
+            self.over = self.won = False
+        while self.position < position and self.step() is not None:
+            pass
+
+class ReplayResult:
+
+    """The outcome of playing back a replay. game is the Game in the state
+    it was left in."""
+
+    def __init__(self, game):
+        self.game = game
+        self.actions = 0
+        self.turns = 0
+        self.over = False
+        self.won = False
+
+    def summary(self):
+        game = self.game
+        return {
+                'actions':  self.actions,
+                'turns':    self.turns,
+                'score':    game.score,
+                'wait_bonus':   game.wait_bonus,
+                'level':    game.level,
+                'enemies':  game.enemy_count,
+                'player':   game.player_coords,
+                'over':     self.over,
+                'won':      self.won
+                }
+
+def print_summary(summary):
+    print('{actions} actions, {turns} turns'.format(**summary))
+    print('Level {level}, score {score}, {enemies} enemies left'.format(
+            **summary))
+    print('Player at {}'.format(summary['player']))
+    if summary['won']:
+        print('The player won.')
+    elif summary['over']:
+        print('The player died.')
+    else:
+        print('The game was unfinished.')
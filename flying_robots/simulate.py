@@ -0,0 +1,143 @@
+"""Headless simulation of complete games, for tuning the game's parameters.
+
+Each game is played by a policy: a function which takes a Game and a
+random.Random instance and returns the next action to take (see
+flying_robots.actions). Games are spread across a pool of worker
+processes, and run_simulation returns a summary of the results.
+
+The seeds for each game (and for its policy) are all drawn up front from a
+single stream, which is seeded from the config if a seed is given there.
+This keeps the games' random streams independent of each other, and the
+results the same however the games are split between workers."""
+
+import random
+import statistics
+from concurrent.futures import ProcessPoolExecutor
+from configparser import ConfigParser
+from time import perf_counter
+
+from flying_robots import stats
+from flying_robots.actions import TELEPORT, move_action
+from flying_robots.exceptions import GameOver
+from flying_robots.game import Game
+from flying_robots.grid import neighbours
+
+def random_policy(game, rng):
+    """Moves in a random direction, whether or not it is safe (if the move
+    is not allowed, the player teleports instead)."""
+    return move_action(*rng.choice(neighbours))
+
+def teleport_policy(game, rng):
+    """Makes a random safe move, and teleports when there is none."""
+    moves = game.grid.safe_moves(game.player_coords)
+    if moves:
+        return move_action(*rng.choice(moves))
+    return TELEPORT
+
+def greedy_policy(game, rng):
+    """Stays put for as long as it is safe to do so, so as to let the robots
+    crash into each other. Otherwise behaves like teleport_policy."""
+    moves = game.grid.safe_moves(game.player_coords)
+    if (0, 0, 0) in moves:
+        return move_action(0, 0, 0)
+    if moves:
+        return move_action(*rng.choice(moves))
+    return TELEPORT
+
+policies = {
+        'random':   random_policy,
+        'greedy':   greedy_policy,
+        'teleport': teleport_policy
+        }
+DEFAULT_POLICY = 'teleport'
+
+def play_game(conf, policy, seed=None, policy_seed=None):
+    """Plays a single game with the given config and policy, and returns a
+    dict of the final score, the level reached, the number of turns played
+    and whether the player won."""
+    game = Game(conf, seed)
+    rng = random.Random(policy_seed)
+    turns = 0
+    won = False
+    while True:
+        result = game.step(policy(game, rng))
+        if not (result.moved or result.turns):
+            # The policy chose a move that wasn't allowed, so teleport
+            # instead, so that the game can't get stuck.
+            result = game.step(TELEPORT)
+        turns += result.turns
+        if result.player_dead:
+            break
+        if result.level_complete:
+            try:
+                game.next_level()
+            except GameOver:
+                won = True
+                break
+    return {'score': game.score, 'level': game.level, 'turns': turns,
+            'won': won}
+
+def _play_games(conf_dict, policy_name, seeds, collect_stats=False):
+    # Runs in a worker process. Config objects can't be pickled, so the
+    # config is passed as a dict and rebuilt here. If collect_stats is True,
+    # the statistics collected while playing are returned along with the
+    # results, to be merged into the parent process's.
+    conf = ConfigParser()
+    conf.read_dict(conf_dict)
+    policy = policies[policy_name]
+    if collect_stats:
+        stats.reset()
+        stats.enable()
+    results = [play_game(conf, policy, *s) for s in seeds]
+    return results, stats.collector() if collect_stats else None
+
+def run_simulation(conf, games, policy=DEFAULT_POLICY, jobs=None, batch=10):
+    """Plays the given number of games across a pool of jobs worker
+    processes (by default, one per CPU), in batches of batch games, and
+    returns a dict summarising the results."""
+    conf_dict = {s: dict(conf[s]) for s in conf.sections()}
+    stream = random.Random(conf['game'].getint('seed', None))
+    seeds = [(stream.getrandbits(64), stream.getrandbits(64))
+            for _ in range(games)]
+    start = perf_counter()
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(_play_games, conf_dict, policy,
+                seeds[i:i+batch], stats.enabled)
+                for i in range(0, games, batch)]
+        results = []
+        for f in futures:
+            batch_results, batch_stats = f.result()
+            results.extend(batch_results)
+            if batch_stats is not None:
+                stats.merge(batch_stats)
+    elapsed = perf_counter() - start
+    return summarise(results, elapsed)
+
+def summarise(results, elapsed):
+    scores = [r['score'] for r in results]
+    levels = [r['level'] for r in results]
+    turns = sum(r['turns'] for r in results)
+    return {
+            'games':        len(results),
+            'seconds':      elapsed,
+            'games_per_sec': len(results) / elapsed,
+            'turns_per_sec': turns / elapsed,
+            'wins':         sum(r['won'] for r in results),
+            'score_mean':   statistics.mean(scores),
+            'score_stdev':  statistics.pstdev(scores),
+            'score_min':    min(scores),
+            'score_median': statistics.median(scores),
+            'score_max':    max(scores),
+            'levels':       {l: levels.count(l) for l in sorted(set(levels))}
+            }
+
+def print_summary(summary):
+    print('{games} games in {seconds:.2f}s: {games_per_sec:.1f} games/s, '
+            '{turns_per_sec:.0f} turns/s'.format(**summary))
+    print('Wins: {wins}'.format(**summary))
+    print('Score: mean {score_mean:.1f}, stdev {score_stdev:.1f}, '
+            'min {score_min}, median {score_median}, '
+            'max {score_max}'.format(**summary))
+    print('Level reached:')
+    for level, count in summary['levels'].items():
+        print('\t{}\t{}'.format(level, count))
@@ -0,0 +1,105 @@
+"""A game grid which stores only the occupied tiles, in a dict for each
+z-level, so that its memory use depends on the number of characters on the
+grid rather than on its volume. It is meant for very large grids, on which
+the list backend would spend most of its memory (and most of the time taken
+to start a level) on empty tiles."""
+
+from flying_robots.chars import gameclass
+from flying_robots.exceptions import BadTileError
+from flying_robots.grid import GameGrid, neighbours, SAFE_TRIES
+
+class SparseGrid(GameGrid):
+
+    """A GameGrid whose tiles are stored only in its index of each z-level's
+    occupants (self.planes, which is also self.grid). There is no index of
+    free tiles; random empty tiles are found by guessing, which is quick as
+    long as the grid is mostly empty."""
+
+    def get_empty_grid(self, x, y, z):
+        self.planes = [{} for k in range(z)]
+        return self.planes
+
+    def set_tile(self, coords, new):
+        x, y, z = coords
+        if not ((0 <= x < self.x) and (0 <= y < self.y) and (0 <= z < self.z)):
+            raise BadTileError('Tile {},{},{} not in grid'.format(x, y, z))
+        if new is None:
+            self.planes[z].pop(y * self.x + x, None)
+        else:
+            self.planes[z][y * self.x + x] = new
+
+    def get_tile(self, coords):
+        x, y, z = coords
+        if not ((0 <= x < self.x) and (0 <= y < self.y) and (0 <= z < self.z)):
+            raise BadTileError('Cannot get tile at {},{},{}: Tile not in grid'.format(x, y, z))
+        return self.planes[z].get(y * self.x + x)
+
+    def is_occupied(self, index):
+        """Takes the linear index of a tile and returns True if it is
+        occupied."""
+        z, i = divmod(index, self.x * self.y)
+        return i in self.planes[z]
+
+    def get_random_empty_coords(self):
+        volume = self.x * self.y * self.z
+        if sum(len(p) for p in self.planes) >= volume:
+            raise BadTileError('No empty tiles.')
+        while True:
+            index = self.rng.randrange(volume)
+            if not self.is_occupied(index):
+                return self.to_coords(index)
+
+    def get_random_safe_coords(self):
+        """Returns the coords of a random empty tile with no robot next to
+        it, or None if there is no such tile. Random tiles are tried first,
+        and every tile is only checked if none of those is safe."""
+        volume = self.x * self.y * self.z
+        for _ in range(SAFE_TRIES):
+            index = self.rng.randrange(volume)
+            if not self.is_occupied(index):
+                coords = self.to_coords(index)
+                if self.tile_is_safe(coords):
+                    return coords
+        safe = [i for i in range(volume) if not self.is_occupied(i)
+                and self.tile_is_safe(self.to_coords(i))]
+        if safe:
+            return self.to_coords(self.rng.choice(safe))
+
+    def safe_moves(self, coords):
+        x, y, z = coords
+        planes = self.planes
+        X, Y = self.x, self.y
+        near = [(i, j, k)
+                for k in range(max(z-2, 0), min(z+3, self.z))
+                for j in range(max(y-2, 0), min(y+3, Y))
+                for i in range(max(x-2, 0), min(x+3, X))
+                if gameclass(planes[k].get(j * X + i)) == 'robot']
+        moves = []
+        for dx, dy, dz in neighbours:
+            nx, ny, nz = x+dx, y+dy, z+dz
+            if not ((0 <= nx < X) and (0 <= ny < Y) and (0 <= nz < self.z)):
+                continue
+            if (dx or dy or dz) and ny * X + nx in planes[nz]:
+                continue
+            if any(abs(i-nx) <= 1 and abs(j-ny) <= 1 and abs(k-nz) <= 1
+                    for i, j, k in near):
+                continue
+            moves.append((dx, dy, dz))
+        return moves
+
+    def clear_entities(self, occupied):
+        self.grid = self.get_empty_grid(self.x, self.y, self.z)
+
+    def put_entity(self, obj):
+        x, y, z = obj.coords
+        self.planes[z][y * self.x + x] = obj
+
+    def view_plan(self, elev=None):
+        """Builds the plan of the given z-level from the characters on it."""
+        if elev is None:
+            elev = self.player.coords[2]
+        plan = [[None] * self.x for _ in range(self.y)]
+        for i, obj in self.planes[elev].items():
+            y, x = divmod(i, self.x)
+            plan[y][x] = obj
+        return plan
@@ -0,0 +1,261 @@
+"""Optional instrumentation of where the time goes during each turn.
+
+When enabled (with enable(), or the --stats command line option), the game
+records how long each phase of a turn takes, how many robots were moved on
+each turn and how many memory blocks each of the player's actions left
+allocated. The phases are:
+
+- action:   the whole of one of the player's actions (a call to Game.step,
+            which may take several turns), including the enemies' turns;
+- decide:   the robots deciding where to move;
+- place:    placing the robots on the grid, and handling any collisions;
+- cleanup:  removing dead robots and updating the grid's indices;
+- batch:    turns played together by fast_forward or an AFAP move, which
+            are not broken down into the phases above;
+- render:   an interface drawing the grid.
+
+Instrumentation is off by default, and while it is off the only cost is a
+check of stats.enabled at each of the points above."""
+
+import sys
+from time import perf_counter
+
+enabled = False
+_collector = None
+
+PHASES = ('action', 'decide', 'place', 'cleanup', 'batch', 'render')
+
+def _min(a, b):
+    return b if a is None else a if b is None else min(a, b)
+
+def _max(a, b):
+    return b if a is None else a if b is None else max(a, b)
+
+class Histogram:
+
+    """A histogram of durations, in buckets whose upper bounds are powers
+    of two microseconds, along with their count, total, minimum and
+    maximum."""
+
+    buckets = 24    # The last bucket holds everything over ~4 seconds.
+
+    def __init__(self):
+        self.counts = [0] * self.buckets
+        self.n = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, seconds):
+        micros = int(seconds * 1000000)
+        self.counts[min(micros.bit_length(), self.buckets-1)] += 1
+        self.n += 1
+        self.total += seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if self.max is None or seconds > self.max:
+            self.max = seconds
+
+    def merge(self, other):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.n += other.n
+        self.total += other.total
+        self.min = _min(self.min, other.min)
+        self.max = _max(self.max, other.max)
+
+    def percentile(self, p):
+        """Returns an upper bound on the pth percentile, in seconds (the
+        upper bound of the bucket it falls in)."""
+        target = self.n * p / 100
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= target:
+                return min(2 ** bucket / 1000000, self.max)
+        return self.max
+
+    def summary(self):
+        if not self.n:
+            return {'count': 0}
+        return {
+                'count':    self.n,
+                'total':    self.total,
+                'mean':     self.total / self.n,
+                'min':      self.min,
+                'p50':      self.percentile(50),
+                'p90':      self.percentile(90),
+                'p99':      self.percentile(99),
+                'max':      self.max,
+                'buckets':  self.counts
+                }
+
+class Counter:
+
+    """Keeps the count, total, minimum and maximum of a series of
+    numbers."""
+
+    def __init__(self):
+        self.n = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        self.n += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        self.n += other.n
+        self.total += other.total
+        self.min = _min(self.min, other.min)
+        self.max = _max(self.max, other.max)
+
+    def summary(self):
+        if not self.n:
+            return {'count': 0}
+        return {
+                'count':    self.n,
+                'total':    self.total,
+                'mean':     self.total / self.n,
+                'min':      self.min,
+                'max':      self.max
+                }
+
+class Collector:
+
+    """Collects the statistics recorded while instrumentation is
+    enabled."""
+
+    def __init__(self):
+        self.phases = {phase: Histogram() for phase in PHASES}
+        self.robots = Counter()     # Robots moved on each turn
+        self.turns = Counter()      # Turns played by each action
+        self.blocks = Counter()     # Net blocks allocated by each action
+        self._action_start = None
+
+    def record(self, phase, seconds):
+        self.phases[phase].add(seconds)
+
+    def begin_action(self):
+        self._action_blocks = sys.getallocatedblocks()
+        self._action_start = perf_counter()
+
+    def end_action(self, turns):
+        if self._action_start is None:
+            return
+        self.phases['action'].add(perf_counter() - self._action_start)
+        self.blocks.add(sys.getallocatedblocks() - self._action_blocks)
+        self.turns.add(turns)
+        self._action_start = None
+
+    def merge(self, other):
+        """Adds the statistics collected by another Collector (for example,
+        one from another process) to this one."""
+        for phase, h in other.phases.items():
+            self.phases[phase].merge(h)
+        self.robots.merge(other.robots)
+        self.turns.merge(other.turns)
+        self.blocks.merge(other.blocks)
+
+    def summary(self):
+        return {
+                'phases':   {p: h.summary() for p, h in self.phases.items()},
+                'robots_per_turn':  self.robots.summary(),
+                'turns_per_action': self.turns.summary(),
+                'blocks_per_action':    self.blocks.summary()
+                }
+
+# The functions below are called by the game and interfaces, and should
+# only be called if stats.enabled is True.
+
+def clock():
+    return perf_counter()
+
+def record(phase, start):
+    """Records that the given phase took from start (a value returned by
+    clock()) until now."""
+    _collector.record(phase, perf_counter() - start)
+
+def record_turn(decided, placed, cleaned, end, robots):
+    """Records the phases of a turn, given the times at which each phase
+    started and when the turn ended, and the number of robots moved."""
+    _collector.record('decide', placed - decided)
+    _collector.record('place', cleaned - placed)
+    _collector.record('cleanup', end - cleaned)
+    _collector.robots.add(robots)
+
+def record_batch(start, turns, robots):
+    """Records turns played together, starting at start, with the number of
+    robots there were at the start."""
+    if turns:
+        _collector.record('batch', (perf_counter() - start) / turns)
+        _collector.robots.add(robots)
+
+def begin_action():
+    _collector.begin_action()
+
+def end_action(turns):
+    _collector.end_action(turns)
+
+# The public API for turning instrumentation on and off and getting the
+# results.
+
+def enable():
+    """Turns on instrumentation. Any statistics already collected are
+    kept."""
+    global enabled, _collector
+    if _collector is None:
+        _collector = Collector()
+    enabled = True
+
+def disable():
+    global enabled
+    enabled = False
+
+def reset():
+    """Discards all statistics collected so far."""
+    global _collector
+    _collector = Collector()
+
+def collector():
+    """Returns the Collector holding the statistics collected so far, or
+    None if instrumentation has never been enabled."""
+    return _collector
+
+def merge(other):
+    """Adds the statistics in another Collector to those collected
+    here."""
+    if _collector is None:
+        reset()
+    _collector.merge(other)
+
+def summary():
+    """Returns a dict summarising the statistics collected so far, or None
+    if instrumentation has never been enabled. All times are in
+    seconds."""
+    if _collector is not None:
+        return _collector.summary()
+
+def print_summary(_file=sys.stderr):
+    s = summary()
+    if s is None:
+        return
+    print('Phase      count       mean        p50        p90        p99'
+            '        max', file=_file)
+    for phase, h in s['phases'].items():
+        if not h['count']:
+            continue
+        print('{:8} {:7} {}'.format(phase, h['count'], ' '.join(
+                '{:8.1f}us'.format(h[k] * 1000000)
+                for k in ('mean', 'p50', 'p90', 'p99', 'max'))), file=_file)
+    for name in ('robots_per_turn', 'turns_per_action', 'blocks_per_action'):
+        c = s[name]
+        if not c['count']:
+            continue
+        print('{}: mean {:.1f}, min {}, max {}'.format(
+                name.replace('_', ' ').capitalize(), c['mean'], c['min'],
+                c['max']), file=_file)
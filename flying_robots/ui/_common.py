@@ -1,6 +1,10 @@
 """This module holds data and functions common to both interfaces
 (curses and tkinter). The contents of this module are subject to change."""
 
+import re
+
+from flying_robots.chars import gameclass_codes
+
 charmap = {
     'robot':    '+',
     'player':   '@',
@@ -19,3 +23,44 @@ xy_move_keys = {
     'u':    (1, -1),
     'x':    (0, 0)
     }
+
+# The interfaces draw a z-level from the class codes of its tiles (see
+# GameGrid.plane_codes), looking up what to draw for each code in a table
+# indexed by code, rather than calling gameclass on each tile's occupant and
+# looking the result up in a charmap.
+
+def code_table(charmap):
+    """Takes a charmap (mapping game classes to whatever is drawn for them)
+    and returns a list of its values, indexed by class code (with None for
+    any class not in the charmap)."""
+    table = [None] * len(gameclass_codes)
+    for cls, code in gameclass_codes.items():
+        table[code] = charmap.get(cls)
+    return table
+
+_occupied = re.compile(b'[^\\x00]')
+
+def occupied_tiles(codes):
+    """Returns the indices of the occupied tiles in a bytes object of class
+    codes."""
+    return [m.start() for m in _occupied.finditer(codes)]
+
+class PlaneRenderer:
+
+    """Turns the class codes of the tiles on a z-level into text, with a
+    single table lookup (by bytes.translate) over all of them. The glyphs
+    in the charmap must be single characters."""
+
+    def __init__(self, charmap=charmap):
+        glyphs = code_table(charmap)
+        self.table = bytes(ord(g) for g in glyphs) + bytes(256-len(glyphs))
+
+    def render(self, codes):
+        """Returns the glyphs for the tiles in codes, as one string."""
+        return codes.translate(self.table).decode('latin-1')
+
+    def rows(self, codes, width):
+        """Returns the glyphs for the tiles in codes as a list of strings,
+        one for each row of the given width."""
+        text = self.render(codes)
+        return [text[i:i+width] for i in range(0, len(text), width)]
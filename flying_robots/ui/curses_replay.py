@@ -0,0 +1,103 @@
+"""A curses viewer for replays (see flying_robots.replay), which can be
+scrubbed forwards and backwards."""
+
+import curses
+
+from flying_robots.replay import Replay, ReplayCursor
+from flying_robots.ui._common import charmap, PlaneRenderer
+
+help_text = ('l/h: +/-1  L/H: +/-10  J/K: +/-100  g: go to  '
+        '</>: elev  q: quit')
+
+class ReplayViewer:
+
+    info_win_width = 18
+
+    renderer = PlaneRenderer(charmap)
+
+    def __init__(self, stdscr, replay):
+        self.stdscr = stdscr
+        self.cursor = ReplayCursor(replay)
+        self.moves = {
+                ord('l'):   1,
+                ord('h'):   -1,
+                ord('L'):   10,
+                ord('H'):   -10,
+                ord('J'):   100,
+                ord('K'):   -100,
+                curses.KEY_RIGHT:   1,
+                curses.KEY_LEFT:    -1,
+                curses.KEY_NPAGE:   100,
+                curses.KEY_PPAGE:   -100
+                }
+        curses.noecho()
+        curses.cbreak()
+        curses.curs_set(0)
+        self.stdscr.keypad(1)
+        x, y, _ = self.cursor.game.grid_size
+        self.grid_win = self.stdscr.subwin(y+2, x+2, 0, 0)
+        self.info_win = self.stdscr.subwin(y+2, self.info_win_width, 0, x+3)
+        self.help_y = y+2
+        self.elev = None
+        self.mainloop()
+
+    def mainloop(self):
+        while True:
+            self.draw()
+            key = self.stdscr.getch()
+            if key == ord('q'):
+                return
+            elif key in self.moves:
+                self.elev = None
+                self.cursor.seek(self.cursor.position + self.moves[key])
+            elif key == ord('g'):
+                position = self.get_num('Go to action: ')
+                if position is not None:
+                    self.elev = None
+                    self.cursor.seek(position)
+            elif key in (ord('<'), ord('>')):
+                elev = self.cursor.game.elev if self.elev is None else self.elev
+                elev += 1 if key == ord('>') else -1
+                if 0 <= elev < self.cursor.game.grid_size[2]:
+                    self.elev = elev
+
+    def draw(self):
+        game = self.cursor.game
+        elev = game.elev if self.elev is None else self.elev
+        self.grid_win.erase()
+        self.grid_win.border()
+        rows = self.renderer.rows(game.grid.plane_codes(elev), game.grid.x)
+        for row_num, row in enumerate(rows):
+            self.grid_win.addstr(row_num+1, 1, row)
+        self.info_win.erase()
+        lines = [
+                'Action:', '{}/{}'.format(self.cursor.position,
+                        len(self.cursor)),
+                '',
+                'Player coords:', str(game.player_coords),
+                'Viewing elev:', str(elev),
+                'Level:', str(game.level),
+                'Enemies:', str(game.enemy_count),
+                'Score:', str(game.score)
+                ]
+        if self.cursor.over:
+            lines.extend(['', 'Player won' if self.cursor.won
+                    else 'Player died'])
+        for i, line in enumerate(lines):
+            self.info_win.addstr(i+1, 0, line[:self.info_win_width-1])
+        self.stdscr.addstr(self.help_y, 0, help_text)
+        self.stdscr.refresh()
+
+    def get_num(self, prompt):
+        self.grid_win.addstr(0, 0, prompt)
+        curses.echo()
+        try:
+            return int(self.grid_win.getstr(0, len(prompt)))
+        except ValueError:
+            return None
+        finally:
+            curses.noecho()
+
+def start_viewer(path):
+    replay = Replay.load(path)
+    curses.wrapper(lambda s: ReplayViewer(s, replay))
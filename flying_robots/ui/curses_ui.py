@@ -1,17 +1,18 @@
 """A basic curses interface for FlyingRobots."""
 
 from sys import stdout, stderr
+from collections import deque
 import curses
 
+from flying_robots import stats
 from flying_robots.game import Game
 from flying_robots.exceptions import LevelComplete, GameOver
-from flying_robots.chars import gameclass
 from flying_robots.hs_handler import get_scores, add_score
 from flying_robots.metadata import app_name
 
 from flying_robots.debug import log
 
-from flying_robots.ui._common import charmap, xy_move_keys
+from flying_robots.ui._common import charmap, xy_move_keys, PlaneRenderer
 from flying_robots.ui.controls import get_classic_ctrls
 
 def ctrl(ch):
@@ -34,12 +35,16 @@ class GameInterface:
     info_win_width = 18
     
     charmap = charmap
+    renderer = PlaneRenderer(charmap)
     xy_move_keys = xy_move_keys
     
     yn_vals = {
         'y':    True,
         'n':    False
         }
+
+    # The commands which prompt the player for input.
+    prompt_cmds = ('quit', 'goto')
     
     def __init__(self, stdscr, config, ctrlset):
         self.stdscr = stdscr
@@ -57,11 +62,13 @@ class GameInterface:
         self.stdscr.clear()
         self.game = Game(config)
         self.grid_size = self.game.grid_size
+        self.drawn_elev = None
+        # Keys which have been read but not yet handled, because a prompt
+        # came before them.
+        self.pending = deque()
         self.setup_nonmove_cmds()
         self.setup_windows()
-        self.update_grid()
-        self.update_info()
-        self.stdscr.refresh()
+        self.render()
         self.mainloop()
     
     def setup_windows(self):
@@ -91,15 +98,29 @@ class GameInterface:
     
     def play_again(self):
         self.game.start_game()
-        self.update_grid()
-        self.update_info()
 
     def update_grid(self):
-        grid = self.game.view_grid()
-        for row_num, row in enumerate(grid):
-            chars = [self.charmap.get(gameclass(ch), ' ') for ch in row]
-            self.grid_win.addstr(row_num+1, 1, ''.join(chars))
+        # Only the rows with tiles which have changed since the grid was last
+        # drawn are redrawn, unless a different level is being viewed.
+        if stats.enabled:
+            start = stats.clock()
+        grid = self.game.grid
+        elev = self.game.elev
+        changes = self.game.take_changes()
+        if changes is None or elev != self.drawn_elev:
+            rows = range(grid.y)
+            self.drawn_elev = elev
+        else:
+            offset = elev * grid.y
+            dirty = {i // grid.x - offset for i in changes}
+            rows = sorted(r for r in dirty if 0 <= r < grid.y)
+        text = self.renderer.render(self.game.view_codes())
+        for row_num in rows:
+            first = row_num * grid.x
+            self.grid_win.addstr(row_num+1, 1, text[first:first+grid.x])
         self.grid_win.noutrefresh()
+        if stats.enabled:
+            stats.record('render', start)
     
     def update_info(self):
         # Maybe make this less verbose
@@ -123,17 +144,80 @@ class GameInterface:
         self.info_win.addstr(y, x, afap)
         self.info_win.noutrefresh()
     
+    def render(self):
+        self.update_grid()
+        self.update_info()
+        self.stdscr.refresh()
+
     def mainloop(self):
+        # All the keys which have been typed since the last time round are
+        # handled together, and the screen is only redrawn once they have
+        # been, so that a held-down key doesn't cost a redraw per repeat.
         while True:
             x, y = self.game.player_coords[:2]
-            cmd_key = chr(self.stdscr.getch(y+1, x+1))  # player posn on grid
+            # The cursor is put at the player's position on the grid.
+            keys = [self.read_key(self.stdscr, y+1, x+1)]
+            keys.extend(self.pending)
+            self.pending.clear()
+            keys.extend(self.typeahead())
             try:
-                self.handle_cmd(cmd_key)
+                self.handle_keys(keys)
             except GameOver as e:
+                self.render()
                 self.on_game_over(*e.args)
             except LevelComplete:
                 self.on_level_complete()
-            self.stdscr.refresh()
+            self.render()
+
+    def read_key(self, win, y, x):
+        """Returns the first pending key, or else waits for a key to be
+        typed at y, x in win."""
+        if self.pending:
+            return self.pending.popleft()
+        return win.getch(y, x)
+
+    def typeahead(self):
+        """Returns the keys which have been typed but not yet read, without
+        waiting for any more."""
+        keys = []
+        self.stdscr.nodelay(1)
+        key = self.stdscr.getch()
+        while key != curses.ERR:
+            keys.append(key)
+            key = self.stdscr.getch()
+        self.stdscr.nodelay(0)
+        return keys
+
+    def handle_keys(self, keys):
+        """Handles the given keys in order. If one of them ends the level,
+        GameOver or LevelComplete is raised. After LevelComplete, the rest
+        are kept to be played on the next level, as they would have been if
+        each key had been read and handled on its own. After GameOver, they
+        are dropped, along with anything else typed, so that keys typed
+        during the game can't answer the prompt to play again."""
+        for n, key in enumerate(keys):
+            cmd = chr(key)
+            if self.is_prompt(cmd):
+                # The player's answer to the prompt may be among the keys
+                # which have already been read, so they are kept to be read
+                # again by the prompt, and then by the mainloop.
+                self.pending.extend(keys[n+1:])
+                self.render()
+                self.handle_cmd(cmd)
+                return
+            try:
+                self.handle_cmd(cmd)
+            except LevelComplete:
+                self.pending.extend(keys[n+1:])
+                raise
+            except GameOver:
+                self.pending.clear()
+                curses.flushinp()
+                raise
+
+    def is_prompt(self, cmd):
+        return (self.controls.is_special_key(cmd)
+                and self.controls.get_special_cmd(cmd) in self.prompt_cmds)
 
     def handle_cmd(self, cmd):
         key = unctrl(cmd).lower()
@@ -142,7 +226,6 @@ class GameInterface:
         elif self.controls.is_special_key(key):
             log(self.controls.get_special_cmd(key))
             self.nonmove_cmds[self.controls.get_special_cmd(cmd)]()
-        self.update_info()
     
     def move(self, cmd):
         if is_ctrl(cmd):
@@ -154,16 +237,13 @@ class GameInterface:
         self.game.move_player(
                 *self.controls.get_move_xyz(unctrl(cmd).lower(), z)
                 )
-        self.update_grid()
     
     def teleport(self):
         self.game.teleport_player()
-        self.update_grid()
     
     def view_elev(self, elev):
         if 0 <= elev < self.grid_size[2]:
             self.game.elev = elev
-            self.update_grid()
     
     def view_next_elev(self):
         self.view_elev(self.game.elev-1)
@@ -180,7 +260,7 @@ class GameInterface:
     def get_yn(self, prompt, default=True, prompt_coords=[0, 0]):
         y, x = prompt_coords
         self.grid_win.addstr(y, x, prompt)
-        ch = chr(self.grid_win.getch(y, x)).lower()
+        ch = chr(self.read_key(self.grid_win, y, x)).lower()
         self.grid_win.border()
         self.grid_win.refresh()
         return self.yn_vals.get(ch, default)
@@ -188,19 +268,32 @@ class GameInterface:
     def get_num(self, prompt, default=None):
         self.grid_win.addstr(0, 0, prompt)
         try:
-            curses.echo()
-            val = int(self.grid_win.getstr(0, len(prompt)))
+            val = int(self.read_str(0, len(prompt)))
         except ValueError:
             val = default
-        curses.noecho()
         self.grid_win.border()
         self.grid_win.refresh()
         return val
+
+    def read_str(self, y, x):
+        """Returns a line typed at y, x in the grid window, starting with
+        any pending keys."""
+        chars = []
+        while self.pending:
+            key = self.pending.popleft()
+            if key in (ord('\n'), ord('\r')):
+                return ''.join(chars)
+            chars.append(chr(key))
+        text = ''.join(chars)
+        self.grid_win.addstr(y, x, text)
+        curses.echo()
+        try:
+            return text + self.grid_win.getstr(y, x+len(text)).decode()
+        finally:
+            curses.noecho()
     
     def on_level_complete(self):
         self.game.next_level()
-        self.update_grid()
-        self.update_info()
 
     def on_game_over(self, victory, msg=None):
         if msg is None:
@@ -227,11 +320,9 @@ class GameInterface:
     
     def toggle_sticky_view(self):
         self.game.toggle_sticky_view()
-        self.update_info()
     
     def toggle_afap(self):
         self.game.toggle_afap()
-        self.update_info()
     
     def handle_hiscores(self, store, _print):
         if store:
@@ -1,6 +1,9 @@
 """A graphical user interface for FlyingRobots, using Tkinter."""
 
+from collections import deque
 from os.path import join, dirname
+from threading import Thread
+from time import perf_counter
 
 import tkinter
 from tkinter import N, W, E, S
@@ -8,14 +11,17 @@ from tkinter.messagebox import askquestion, showinfo
 from tkinter.simpledialog import askinteger, Dialog
 from tkinter.font import Font
 
+from flying_robots import stats
+from flying_robots.actions import TELEPORT, WAIT
+from flying_robots.config import DEFAULT_FPS
 from flying_robots.game import Game
-from flying_robots.exceptions import LevelComplete, GameOver
-from flying_robots.chars import gameclass
+from flying_robots.exceptions import GameOver
 from flying_robots.hs_handler import get_scores, add_score
 from flying_robots.metadata import (app_name, description, version,
         license_name, license_text, author, homepage_url)
 
-from flying_robots.ui._common import charmap, xy_move_keys
+from flying_robots.ui._common import (charmap, xy_move_keys, code_table,
+        occupied_tiles)
 from flying_robots.ui.controls import get_classic_ctrls, get_new_ctrls
 
 GFX_DIR = join(dirname(__file__), 'gfx')
@@ -23,6 +29,10 @@ GFX_DIR = join(dirname(__file__), 'gfx')
 img_w, img_h = 10, 20
 borderwidth = 2
 
+# How often (in milliseconds) to check whether the worker thread playing the
+# player's moves has finished.
+POLL_MS = 10
+
 charmap = {
         'player':   join(GFX_DIR, 'player.gif'),
         'robot':    join(GFX_DIR, 'robot.gif'),
@@ -139,7 +149,24 @@ class GameInterface(tkinter.Frame):
         self.game = Game(config)
         self.grid_size = self.game.grid_size
         w, h, _ = self.grid_size
-        self.grid_imgs = set()
+        # The canvas item drawn on each occupied tile of the level being
+        # viewed, as a dict mapping the tile's index within the level to the
+        # item and the class code of its occupant.
+        self.grid_items = {}
+        self.drawn_elev = None
+        # Input which has yet to be carried out (see handle_keypress), and
+        # the thread playing the game commands taken from it, if any.
+        self.pending = deque()
+        self.input_scheduled = False
+        self.worker = None
+        self.worker_result = None
+        self.worker_error = None
+        fps = DEFAULT_FPS
+        if config.has_section('ui'):
+            fps = config['ui'].getint('fps', DEFAULT_FPS)
+        self.frame_time = 1 / fps
+        self.last_redraw = 0
+        self.redraw_id = None
         self.bw = borderwidth
         self.grid_widget_h = h * img_h
         self.grid_widget_w = w * img_w
@@ -147,8 +174,7 @@ class GameInterface(tkinter.Frame):
         self.setup_nonmove_cmds()
         self.bind_all('<Any-KeyPress>', self.handle_keypress)
         self.setup_widgets()
-        self.update_grid()
-        self.update_info()
+        self.redraw()
 
     def set_new_ctrls(self):
         self.controls = get_new_ctrls(special_keymap)
@@ -161,6 +187,7 @@ class GameInterface(tkinter.Frame):
         for char in charmap:
             _charmap[char] = tkinter.PhotoImage(file=charmap[char])
         self.charmap = _charmap
+        self.images = code_table(_charmap)
 
     def setup_widgets(self):
 
@@ -207,7 +234,7 @@ class GameInterface(tkinter.Frame):
                 )
         elev_spinbox = tkinter.Spinbox(
                 elev_frame,
-                command=self.view_elev,
+                command=self.queued(self.view_elev),
                 from_=0,
                 to=(z-1),
                 increment=1,
@@ -218,7 +245,7 @@ class GameInterface(tkinter.Frame):
         view_player_button = tkinter.Button(
                 elev_frame,
                 anchor=tkinter.CENTER,
-                command=self.view_player_elev,
+                command=self.queued(self.view_player_elev),
                 height=1,
                 text='player'
                 )
@@ -273,14 +300,14 @@ class GameInterface(tkinter.Frame):
         self.sticky_var = tkinter.IntVar()
         sticky_chbox = tkinter.Checkbutton(
                 modes_frame,
-                command=self.toggle_sticky,
+                command=self.queued(self.toggle_sticky),
                 text='Sticky mode',
                 variable=self.sticky_var
                 )
         self.afap_var = tkinter.IntVar()
         afap_chbox = tkinter.Checkbutton(
                 modes_frame,
-                command=self.toggle_afap,
+                command=self.queued(self.toggle_afap),
                 text='Move as far as possible',
                 variable=self.afap_var
                 )
@@ -311,7 +338,7 @@ class GameInterface(tkinter.Frame):
         gamebutton['menu'] = gamemenu
         gamemenu.add_command(
                 label='New game',
-                command=self.play_again
+                command=self.queued(self.play_again)
                 )
 
         ctrlmenu = tkinter.Menu(gamebutton, tearoff=0)
@@ -373,19 +400,69 @@ class GameInterface(tkinter.Frame):
 
 
     def update_grid(self):
-        obj_grid = self.game.view_grid()
+        # Only the tiles which have changed since the grid was last drawn are
+        # redrawn, unless a different level is being viewed.
+        if stats.enabled:
+            start = stats.clock()
+        changes = self.game.take_changes()
+        if changes is None or self.game.elev != self.drawn_elev:
+            self.redraw_grid()
+        else:
+            self.apply_changes(changes)
+        if stats.enabled:
+            stats.record('render', start)
+
+    def redraw_grid(self):
         self.grid_widget.delete(tkinter.ALL)
-        for obj in self.game.objects:
-            x, y, z = obj.coords
-            if not z == self.game.elev:
+        self.grid_items = {}
+        self.drawn_elev = self.game.elev
+        codes = self.game.view_codes()
+        for i in occupied_tiles(codes):
+            self.grid_items[i] = (self.create_item(i, codes[i]), codes[i])
+
+    def apply_changes(self, changes):
+        # Items which are no longer needed where they are are moved to any
+        # tiles which need an item of the same class, and are only deleted
+        # if there are none left.
+        plane = self.game.grid.x * self.game.grid.y
+        offset = self.drawn_elev * plane
+        codes = self.game.view_codes()
+        spare = {}
+        needed = []
+        for index in changes:
+            i = index - offset
+            if not 0 <= i < plane:
                 continue
-            x_pos = (x * img_w) + self.bw
-            y_pos = (y * img_h) + self.bw
-            self.grid_imgs.add(
-                    self.grid_widget.create_image(x_pos, y_pos, 
-                        image=self.charmap[gameclass(obj)],
-                        anchor=tkinter.NW)
-                    )
+            code = codes[i]
+            old = self.grid_items.get(i)
+            if old is not None:
+                if old[1] == code:
+                    continue
+                del self.grid_items[i]
+                spare.setdefault(old[1], []).append(old[0])
+            if code:
+                needed.append((i, code))
+        for i, code in needed:
+            if spare.get(code):
+                item = spare[code].pop()
+                self.grid_widget.coords(item, *self.item_pos(i))
+            else:
+                item = self.create_item(i, code)
+            self.grid_items[i] = (item, code)
+        for items in spare.values():
+            for item in items:
+                self.grid_widget.delete(item)
+
+    def item_pos(self, i):
+        """Returns the position on the canvas of the tile with the given
+        index within its level."""
+        y, x = divmod(i, self.game.grid.x)
+        return (x * img_w) + self.bw, (y * img_h) + self.bw
+
+    def create_item(self, i, code):
+        x_pos, y_pos = self.item_pos(i)
+        return self.grid_widget.create_image(x_pos, y_pos,
+                image=self.images[code], anchor=tkinter.NW)
 
     def view_elev(self, elev=None):
         if elev is None:
@@ -393,7 +470,7 @@ class GameInterface(tkinter.Frame):
         if 0 <= elev < self.grid_size[2]:
             self.elev_var.set(elev)
             self.game.elev = elev
-            self.update_grid()
+            self.request_redraw()
 
     def view_next_elev(self):
         elev = int(self.elev_var.get()) + 1
@@ -418,53 +495,147 @@ class GameInterface(tkinter.Frame):
                 'quit':     self.prompt_quit,
                 'next':     self.view_next_elev,
                 'prev':     self.view_prev_elev,
-                'tele':     self.teleport,
+                'tele':     TELEPORT,
                 'player':   self.view_player_elev,
-                'wait':     self.wait,
+                'wait':     WAIT,
                 'goto':     self.prompt_goto_elev,
                 'sticky':   self.toggle_sticky,
                 'afap':     self.toggle_afap
                 }
 
     def move(self, event):
-        """Takes an Event instance which represents a movement key,
-        and processes movement accordingly.
-        """
+        """Takes an Event instance which represents a movement key, and
+        returns the direction in which the player is to move."""
         if (event.state & 1) or (event.state & 2):  # Shift or caps lock
             z = 1
         elif event.state & 4:   # Ctrl key
             z = -1
         else:
             z = 0
-        self.game.move_player(
-                *self.controls.get_move_xyz(event.keysym.lower(), z)
-                )
-        self.update_grid()
-        self.update_info()
-
-    def teleport(self):
-        self.game.teleport_player()
-        self.update_grid()
-        self.update_info()
+        return self.controls.get_move_xyz(event.keysym.lower(), z)
 
     def handle_keypress(self, event):
+        # Commands are queued rather than carried out straight away, so that
+        # keys pressed while the game is busy (for instance, by key
+        # autorepeat) are dealt with together (see process_input). Moves are
+        # queued as their direction, teleporting and waiting as their action
+        # and everything else as a function to call.
         if self.game_over:
             return
         key = event.keysym
+        if self.controls.is_move_key(key.lower()):
+            self.queue_input(self.move(event))
+        elif self.controls.is_special_key(key):
+            self.queue_input(
+                    self.nonmove_cmds[self.controls.get_special_cmd(key)])
+
+    def queue_input(self, cmd):
+        self.pending.append(cmd)
+        if not self.input_scheduled and self.worker is None:
+            self.input_scheduled = True
+            self.after_idle(self.process_input)
+
+    def queued(self, cmd):
+        """Returns a function which queues cmd, for widgets whose commands
+        change the game, as the game mustn't be changed while the worker
+        thread is playing it."""
+        return lambda: self.queue_input(cmd)
+
+    def process_input(self):
+        """Carries out the queued commands in order. Each run of game
+        commands (moves, teleports and waits) is played on a worker thread,
+        so that the window stays responsive during long actions, and the
+        grid is redrawn once the run has been played, rather than after
+        each command."""
+        # self.input_scheduled stays set until the queue has been dealt
+        # with, as a command may open a dialog, during which more input can
+        # arrive; it is picked up by the loop below.
+        while self.pending and self.worker is None:
+            if callable(self.pending[0]):
+                self.pending.popleft()()
+            else:
+                self.start_worker(self.take_actions())
+        self.input_scheduled = False
+        if self.worker is None:
+            self.request_redraw()
+
+    def take_actions(self):
+        """Removes the run of game commands from the front of the queue,
+        and returns their actions."""
+        actions = []
+        while self.pending and not callable(self.pending[0]):
+            cmd = self.pending.popleft()
+            if isinstance(cmd, tuple):
+                cmd = self.game.move_action(*cmd)
+            actions.append(cmd)
+        return actions
+
+    def start_worker(self, actions):
+        self.worker_result = self.worker_error = None
+        self.worker = Thread(target=self.play_actions, args=(actions,),
+                daemon=True)
+        self.worker.start()
+        self.after(POLL_MS, self.poll_worker)
+
+    def play_actions(self, actions):
+        # This runs on the worker thread, so mustn't touch any widgets. An
+        # exception is handed back to the main thread, to be raised there.
         try:
-            if self.controls.is_move_key(key.lower()):
-                self.move(event)
-            elif self.controls.is_special_key(key):
-                self.nonmove_cmds[self.controls.get_special_cmd(key)]()
-        except LevelComplete:
-            self.on_level_complete()
-        except GameOver as e:
-            self.on_game_over(*e.args)
+            for action in actions:
+                self.worker_result = self.game.step(action)
+                if self.worker_result.over:
+                    break
+        except Exception as e:
+            self.worker_error = e
+
+    def poll_worker(self):
+        if self.worker.is_alive():
+            self.after(POLL_MS, self.poll_worker)
+            return
+        self.worker = None
+        if self.worker_error is not None:
+            self.pending.clear()
+            raise self.worker_error
+        result = self.worker_result
+        if result.over:
+            # Anything still queued was meant for the level which has just
+            # ended.
+            self.pending.clear()
+            self.redraw()
+            try:
+                if result.player_dead:
+                    raise GameOver(False, 'You died!')
+                self.on_level_complete()
+            except GameOver as e:
+                self.on_game_over(*e.args)
+        self.process_input()
+
+    def request_redraw(self):
+        """Redraws the grid and the game info, or schedules them to be
+        redrawn if they were last redrawn less than a frame ago."""
+        if self.redraw_id is not None:
+            return
+        delay = self.last_redraw + self.frame_time - perf_counter()
+        if delay <= 0:
+            self.redraw()
+        else:
+            self.redraw_id = self.after(int(delay * 1000) + 1, self.redraw)
+
+    def redraw(self):
+        if self.redraw_id is not None:
+            self.after_cancel(self.redraw_id)
+            self.redraw_id = None
+        # The grid can't be drawn while the worker thread is changing it;
+        # it is redrawn when the worker has finished.
+        if self.worker is not None:
+            return
+        self.update_grid()
+        self.update_info()
+        self.last_redraw = perf_counter()
 
     def on_level_complete(self):
         self.game.next_level()
-        self.update_grid()
-        self.update_info()
+        self.redraw()
 
     def on_game_over(self, victory, msg=None):
         self.game_over = True
@@ -482,8 +653,7 @@ class GameInterface(tkinter.Frame):
     def play_again(self):
         self.game_over = False
         self.game.start_game()
-        self.update_grid()
-        self.update_info()
+        self.redraw()
 
     def handle_hiscores(self, store, _print):
         if store:
@@ -522,9 +692,6 @@ class GameInterface(tkinter.Frame):
         if self.get_yn('Really quit?'):
             self.quit()
 
-    def wait(self):
-        self.game.wait()
-
     def prompt_goto_elev(self):
         self.view_elev(askinteger('', 'Goto:'))
 
@@ -22,6 +22,7 @@ setup(
         packages=['flying_robots', 'flying_robots.ui'],
         package_data={'flying_robots.ui': ['gfx/*.gif']},
         scripts=scripts,
+        extras_require={'array': ['numpy']},
         url=homepage_url,
         description=description,
         download_url=download_url,
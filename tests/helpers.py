@@ -0,0 +1,36 @@
+"""Things shared by the tests."""
+
+from flying_robots.config import get_config
+from flying_robots.game import Game
+from flying_robots.grid import grid_backends
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# The backends which can be tested here, as the array backend needs numpy.
+backends = [b for b in grid_backends if b != 'array' or numpy is not None]
+
+def make_game(backend='list', seed=0, level=1, size=None):
+    """Returns a new game using the default config, except for the given
+    backend, seed, start level and grid size (x, y, z)."""
+    config = get_config()
+    config['game']['start_level'] = str(level)
+    config['grid']['backend'] = backend
+    if size is not None:
+        for axis, n in zip('xyz', size):
+            config['grid'][axis] = str(n)
+    return Game(config, seed)
+
+def result_fields(result):
+    """Returns the fields of a TurnResult as a dict, for comparing."""
+    return {name: getattr(result, name) for name in result.__slots__}
+
+def next_game(game, result, seed):
+    """Starts the next level if result completed one, or a new game with
+    the given seed if the player died or won."""
+    if result.level_complete and game.level < game.max_level:
+        game.next_level()
+    else:
+        game.start_game(seed)
@@ -0,0 +1,45 @@
+import random
+import unittest
+
+from flying_robots.actions import move_action, TELEPORT, SAFE_TELEPORT, WAIT
+from flying_robots.chars import gameclass
+from flying_robots.grid import neighbours
+
+from tests.helpers import numpy, make_game, result_fields, next_game
+
+def positions(game):
+    # A dead player is left in the list backend's objects, but not in the
+    # array backend's.
+    return sorted((tuple(o.coords), gameclass(o)) for o in game.objects
+            if getattr(o, 'is_alive', True))
+
+@unittest.skipIf(numpy is None, 'the array backend needs numpy')
+class ArrayBackendTest(unittest.TestCase):
+
+    """The array backend moves all the robots in one batch step, which must
+    give the same result as the list backend moving them one at a time."""
+
+    def test_plays_as_list_backend(self):
+        steps = [move_action(*d) for d in neighbours] + [TELEPORT]
+        for seed in range(4):
+            with self.subTest(seed=seed):
+                rng = random.Random(seed)
+                games = [make_game(backend, seed, 1 + 2 * seed,
+                        (40, 16, 12)) for backend in ('list', 'array')]
+                for i in range(200):
+                    # An occasional wait ends the level, so that later
+                    # levels are played too.
+                    action = rng.choice(steps)
+                    if rng.random() < 0.02:
+                        action = rng.choice([WAIT, SAFE_TELEPORT])
+                    results = [game.step(action) for game in games]
+                    self.assertEqual(*map(result_fields, results))
+                    self.assertEqual(*map(positions, games))
+                    self.assertEqual(*(game.score for game in games))
+                    self.assertEqual(*(game.level for game in games))
+                    if results[0].over:
+                        for game in games:
+                            next_game(game, results[0], seed + i)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,208 @@
+import random
+import sys
+import unittest
+from array import array
+
+from flying_robots.actions import move_action, WAIT
+from flying_robots.chars import ROBOT, JUNK, PLAYER
+from flying_robots.grid import (neighbours, PLAYING, PLAYER_DEAD,
+        LEVEL_COMPLETE, MOVED, DESTROYED, JUNKED, PLAYER_DIED, LEVEL_CLEARED,
+        RESET)
+
+from tests.helpers import backends, make_game
+
+moves = [move_action(*d) for d in neighbours]
+
+def game_pair(backend, seed, level):
+    """Returns two games in the same state, partway through a level."""
+    rng = random.Random(seed)
+    games = [make_game(backend, seed, level, (30, 15, 10)) for _ in range(2)]
+    for _ in range(rng.randrange(10)):
+        action = rng.choice(moves)
+        if any(game.step(action).over for game in games):
+            break
+    return games
+
+def set_board(game, player, robots, junk=()):
+    """Replaces the characters on the game's grid with a player, robots and
+    junk at the given offsets from (14, 5, 5)."""
+    grid = game.grid
+    coords = [player] + list(robots) + list(junk)
+    tiles = array('I', [grid.to_index([14 + x, 5 + y, 5 + z])
+            for x, y, z in coords])
+    if sys.byteorder == 'big':
+        tiles.byteswap()
+    codes = bytes([PLAYER] + [ROBOT] * len(robots) + [JUNK] * len(junk))
+    grid.load_entities(tiles.tobytes(), codes)
+
+# Two pairs of robots which collide on the third turn, and a robot which
+# runs into junk on the same turn, clearing the level.
+clearing_robots = [(6, 1, 0), (6, 3, 0), (-6, 1, 0), (-6, 3, 0), (0, 8, 0)]
+clearing_junk = [(0, 5, 0)]
+# The same, but with another robot which reaches the player on the fifth
+# turn, after the others have been destroyed.
+killing_robots = clearing_robots + [(5, 5, 2)]
+
+def wait_turn_by_turn(game):
+    """Waits as the game did before waits were played in one batch, one
+    enemies_turn at a time, and returns the outcome and the number of
+    turns played."""
+    game.waiting = True
+    outcome, turns = PLAYING, 0
+    while outcome == PLAYING:
+        outcome = game.grid.enemies_turn()
+        turns += 1
+    return outcome, turns
+
+def afap_step_by_step(game, dx, dy, dz):
+    """Moves the player as far as possible one step at a time, as AFAP
+    moves were played before they were batched, and returns the total
+    turns, kills and score, and whether the level ended."""
+    totals = [0, 0, 0]
+    while True:
+        result = game.step(move_action(dx, dy, dz))
+        if not result.moved:
+            return totals + [False]
+        totals = [totals[0] + result.turns, totals[1] + result.kills,
+                totals[2] + result.score]
+        if result.over:
+            return totals + [True]
+
+class Board:
+
+    """A copy of what is on each tile of a game's grid, which update keeps
+    up to date from the grid's change sets alone."""
+
+    def __init__(self, game):
+        self.game = game
+        self.outcomes = []
+        self.reset()
+
+    def reset(self):
+        grid = self.game.grid
+        plane = grid.x * grid.y
+        self.tiles = {}
+        for z in range(grid.z):
+            for i, code in enumerate(grid.plane_codes(z)):
+                if code:
+                    self.tiles[z * plane + i] = [code]
+
+    def update(self, events):
+        # A tile can briefly hold several characters during a turn, for
+        # example two robots which have just collided.
+        for event in events:
+            kind, tiles = event[0], event[1:]
+            if kind == MOVED:
+                old, new = tiles
+                chars = self.tiles[old]
+                code = ROBOT if ROBOT in chars else PLAYER
+                chars.remove(code)
+                self.tiles.setdefault(new, []).append(code)
+            elif kind == DESTROYED:
+                self.tiles[tiles[0]].remove(ROBOT)
+            elif kind == JUNKED:
+                self.tiles.setdefault(tiles[0], []).append(JUNK)
+            elif kind == PLAYER_DIED:
+                self.tiles[tiles[0]].remove(PLAYER)
+                self.outcomes.append(event)
+            elif kind == LEVEL_CLEARED:
+                self.outcomes.append(event)
+            elif kind == RESET:
+                self.reset()
+
+    def codes(self):
+        return {t: chars for t, chars in self.tiles.items() if chars}
+
+class WaitTest(unittest.TestCase):
+
+    def check_wait(self, batched, single):
+        """Waits in both games, batched in one and turn by turn in the
+        other, checks that the results are the same and returns the
+        outcome."""
+        result = batched.step(WAIT)
+        outcome, turns = wait_turn_by_turn(single)
+        self.assertEqual(result.turns, turns)
+        self.assertEqual(result.player_dead, outcome == PLAYER_DEAD)
+        self.assertEqual(result.level_complete, outcome == LEVEL_COMPLETE)
+        self.assertEqual(batched.score, single.score)
+        self.assertEqual(batched.wait_bonus, single.wait_bonus)
+        self.assertEqual(batched.snapshot(), single.snapshot())
+        return outcome, turns
+
+    def test_wait_clearing_level(self):
+        for backend in backends:
+            with self.subTest(backend=backend):
+                games = game_pair(backend, 0, 1)
+                for game in games:
+                    set_board(game, (0, 0, 0), clearing_robots, clearing_junk)
+                self.assertEqual(self.check_wait(*games), (LEVEL_COMPLETE, 3))
+                self.assertGreater(games[0].wait_bonus, 0)
+
+    def test_player_dying_partway_through_wait(self):
+        for backend in backends:
+            with self.subTest(backend=backend):
+                games = game_pair(backend, 0, 1)
+                for game in games:
+                    set_board(game, (0, 0, 0), killing_robots, clearing_junk)
+                self.assertEqual(self.check_wait(*games), (PLAYER_DEAD, 5))
+                self.assertGreater(games[0].wait_bonus, 0)
+
+    def test_batched_wait_matches_single_turns(self):
+        for backend in backends:
+            for seed in range(12):
+                with self.subTest(backend=backend, seed=seed):
+                    batched, single = game_pair(backend, seed, 2 + seed % 4)
+                    if batched.grid.player.is_alive and batched.enemy_count:
+                        self.check_wait(batched, single)
+
+class AfapTest(unittest.TestCase):
+
+    def check_afap(self, batched, single, direction):
+        boards = [Board(batched), Board(single)]
+        for board in boards:
+            board.game.subscribe(board.update)
+        result = batched.step(move_action(*direction, afap=True))
+        turns, kills, score, over = afap_step_by_step(single, *direction)
+        self.assertEqual([result.turns, result.kills, result.score,
+                result.over], [turns, kills, score, over])
+        self.assertEqual(batched.player_coords, single.player_coords)
+        self.assertEqual(batched.score, single.score)
+        self.assertEqual(batched.snapshot(), single.snapshot())
+        # The batch reports the net changes of all its turns, so the boards
+        # built from each game's events must both end up matching the grid.
+        for board in boards:
+            board.game.unsubscribe(board.update)
+            self.assertEqual(board.codes(), Board(board.game).codes())
+        self.assertEqual(boards[0].outcomes, boards[1].outcomes)
+        return result
+
+    def test_afap_on_made_board(self):
+        # Depending on the direction, the player is stopped by the edge of
+        # the grid or by danger, or the robots are all destroyed on the way.
+        for backend in backends:
+            results = set()
+            for direction in neighbours:
+                with self.subTest(backend=backend, direction=direction):
+                    games = game_pair(backend, 0, 1)
+                    for game in games:
+                        set_board(game, (0, 0, 0), clearing_robots,
+                                clearing_junk)
+                    result = self.check_afap(*games, direction)
+                    results.add((result.turns > 1, result.level_complete))
+            self.assertIn((True, False), results)
+            self.assertIn((True, True), results)
+
+    def test_afap_matches_steps(self):
+        # Fresh level 1 games leave the player room to run, often through
+        # several turns and past robots colliding with each other.
+        for backend in backends:
+            for seed in range(4):
+                for direction in neighbours:
+                    with self.subTest(backend=backend, seed=seed,
+                            direction=direction):
+                        games = [make_game(backend, seed, 1, (30, 15, 10))
+                                for _ in range(2)]
+                        self.check_afap(*games, direction)
+
+if __name__ == '__main__':
+    unittest.main()
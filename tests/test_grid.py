@@ -0,0 +1,69 @@
+import random
+import unittest
+
+from flying_robots.grid import GameGrid, FREE_BLOCK
+
+from tests.helpers import backends, make_game
+
+class FreeIndexTest(unittest.TestCase):
+
+    def test_nth_free_counts_free_tiles_in_order(self):
+        # A grid whose last block is only partly used, so that the search
+        # has to stop at the end of the grid.
+        grid = GameGrid(FREE_BLOCK // 4 + 3, 5, 7, None, random.Random(0))
+        volume = grid.x * grid.y * grid.z
+        rng = random.Random(1)
+        free = set(range(volume))
+        for i in range(4000):
+            if free and (len(free) == volume or rng.random() < 0.55):
+                tile = rng.choice(sorted(free))
+                grid.take_free(tile)
+                free.remove(tile)
+            else:
+                tile = rng.choice(sorted(set(range(volume)) - free))
+                grid.add_free(tile)
+                free.add(tile)
+            if i % 100 == 0:
+                self.assertEqual(grid.n_free, len(free))
+                self.assertEqual([grid.nth_free(n) for n in range(len(free))],
+                        sorted(free))
+
+    def test_rebuilt_index_matches_updated_one(self):
+        grid = GameGrid(40, 16, 12, None, random.Random(0))
+        volume = grid.x * grid.y * grid.z
+        occupied = sorted(random.Random(2).sample(range(volume), 3000))
+        for tile in occupied:
+            grid.take_free(tile)
+        tree = list(grid.free_tree)
+        grid.reset_free_except(occupied, volume)
+        self.assertEqual(grid.free_tree, tree)
+
+class SafeTilesTest(unittest.TestCase):
+
+    def test_safe_tiles_are_empty_tiles_with_no_robot_next_to_them(self):
+        for backend in ('list', 'array'):
+            if backend not in backends:
+                continue
+            for level in (1, 5, 10):
+                with self.subTest(backend=backend, level=level):
+                    grid = make_game(backend, level, level, (30, 15, 10)).grid
+                    expected = [i for i in range(30 * 15 * 10)
+                            if grid.tile_is_empty(grid.to_coords(i))
+                            and grid.tile_is_safe(grid.to_coords(i))]
+                    self.assertEqual(grid.safe_tiles(), expected)
+                    coords = grid.get_random_safe_coords()
+                    self.assertIn(grid.to_index(coords), expected)
+
+    def test_no_safe_coords_on_a_crowded_grid(self):
+        # Every empty tile is next to a robot, so the random tries all fail
+        # and the fallback finds nothing.
+        for backend in backends:
+            with self.subTest(backend=backend):
+                grid = make_game(backend, 0, 1, (9, 3, 3)).grid
+                grid.populate(9 * 3 * 3 // 2)
+                self.assertTrue(all(not grid.tile_is_safe(grid.to_coords(i))
+                        for i in range(9 * 3 * 3)))
+                self.assertIsNone(grid.get_random_safe_coords())
+
+if __name__ == '__main__':
+    unittest.main()